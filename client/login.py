@@ -1,9 +1,276 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
-from PIL import Image, ImageTk
-import os
+from tkinter import ttk
+import hashlib, os, platform, re, tempfile
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Optional, List
 
+AVATAR_SIZE = 140   # side length (px) of avatars shown in the login grid
+THUMB_CACHE_DIR = os.path.expanduser("~/.cache/chatroom/avatars")   # resized avatars persisted across launches
+AVATAR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "img", "avatar")   # client/img/avatar
+AVATAR_BORDER_IDLE = "#f3f3f3"       # avatar border when not selected (same as window background)
+AVATAR_BORDER_SELECTED = "#2196F3"   # border of the selected avatar
+AVATAR_BORDER_WIDTH = 4   # px, drawn as a rectangle item on each avatar canvas
+AVATAR_PAD = 2            # px of white between the border and the image
+MAX_AVATAR_PIXELS = 4096 * 4096   # refuse to decode larger sources (protects against huge/bomb images)
+MAX_BUFFERED_AVATAR_BYTES = 2 * 1024 * 1024   # larger avatar files are not kept in memory
+PREGEN_THUMB_DIR = "thumb"   # subfolder of the avatar dir with shipped pre-sized thumbnails
+
+_AVATAR_RE = re.compile(r"avatar\s*(\d+)")   # number in names like "avatar 3.png", used for ordering
+
+# Letters and digits (Unicode, like str.isalnum), underscores, hyphens and spaces
+_USERNAME_CHARS_RE = re.compile(r"[\w\- ]+")
+_USERNAME_RE = re.compile(r"[\w\- ]{2,20}")   # charset and length (2-20) in one fullmatch
+_simd_hint_shown = False   # the Pillow-SIMD hint is printed at most once per process
+
+# Pillow modules, imported on first use by _pil() so the login window is drawn before
+# the image libraries (libjpeg, libpng, libwebp, ...) are loaded
+Image = None
+ImageTk = None
+
+# Raw contents of avatar files that still need a thumbnail (path -> bytes), so retrying
+# the login window does not re-read them from disk
+_AVATAR_BYTES: dict[str, bytes] = {}
+
+
+def _pil() -> None:
+    '''Import PIL.Image and PIL.ImageTk into this module the first time they are needed'''
+    global Image, ImageTk
+    if ImageTk is None:
+        from PIL import Image as _Image, ImageTk as _ImageTk
+        Image, ImageTk = _Image, _ImageTk
+
+
+@lru_cache(maxsize=1)
+def _discover_avatar_files(img_dir: str, mtime_ns: int) -> tuple[str, ...]:
+    '''
+    Scan img_dir for avatar images and return their paths in display order.
+    mtime_ns (of the directory) is only part of the cache key: adding or removing a file
+    changes it, which triggers a fresh scan. Raises OSError if the directory is unreadable.
+    '''
+    # scandir yields names and file types in one pass (no per-entry stat on Linux/Windows);
+    # is_file() also skips the thumb/ subfolder
+    with os.scandir(img_dir) as it:
+        entries = [e for e in it
+                   if e.name.lower().endswith(('.png', '.jpg', '.jpeg')) and e.is_file()]
+
+    def sort_key(entry: os.DirEntry):
+        base = entry.name.lower()
+        m = _AVATAR_RE.search(base)
+        return (0, int(m.group(1))) if m else (1, base)
+
+    entries.sort(key=sort_key)
+    return tuple(e.path for e in entries)
+
+
+def thumb_cache_path(src_path: str, size: int = AVATAR_SIZE, prefix: str = "") -> str:
+    '''
+    Return the on-disk cache path of the resized thumbnail for an avatar file.
+    The key includes mtime and size so an edited source image gets a fresh thumbnail;
+    prefix separates different renderings of the same source (e.g. "circle_").
+    '''
+    src_path = os.path.abspath(src_path)
+    st = os.stat(src_path)
+    key = f"{src_path}|{st.st_mtime_ns}|{st.st_size}|{size}"
+    return os.path.join(THUMB_CACHE_DIR, prefix + hashlib.sha1(key.encode()).hexdigest() + ".png")
+
+
+def pregen_thumb_path(src_path: str, size: int = AVATAR_SIZE) -> str:
+    '''
+    Return the path of the shipped pre-sized thumbnail of an avatar file,
+    e.g. "img/avatar/avatar 3.png" -> "img/avatar/thumb/avatar_3_140.webp"
+    (generated by client/tools/pregen_thumbnails.py).
+    '''
+    folder, name = os.path.split(src_path)
+    stem = os.path.splitext(name)[0].replace(" ", "_")
+    return os.path.join(folder, PREGEN_THUMB_DIR, f"{stem}_{size}.webp")
+
+
+def avatar_sheet_path(img_dir: str, size: int = AVATAR_SIZE) -> str:
+    '''
+    Return the path of the shipped sprite sheet: every pre-sized avatar stacked vertically
+    in size x size cells, in display order (its "avatars" PNG text lists the source names).
+    '''
+    return os.path.join(img_dir, PREGEN_THUMB_DIR, f"avatars_sheet_{size}.png")
+
+
+def _fresh_pregen_thumb(src_path: str, size: int = AVATAR_SIZE) -> Optional[str]:
+    '''Return the pre-sized thumbnail path if it exists and is not older than the source'''
+    thumb = pregen_thumb_path(src_path, size)
+    try:
+        if os.stat(thumb).st_mtime_ns >= os.stat(src_path).st_mtime_ns:
+            return thumb
+    except OSError:
+        pass
+    return None
+
+
+def save_thumbnail(img, cache_path: str, raw: bool = False) -> bool:
+    '''
+    Write a thumbnail into the cache atomically (temp file + os.replace),
+    so a crash never leaves a half-written PNG behind. Returns True on success.
+    With raw=True the pixels are stored as they are (img.tobytes(), no PNG encoding), for
+    caches that are read back with Image.frombuffer instead of being decoded.
+    '''
+    cache_dir = os.path.dirname(cache_path)
+    tmp_name = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False) as tmp:
+            tmp_name = tmp.name
+            if raw:
+                tmp.write(img.tobytes())
+            else:
+                img.save(tmp, "PNG", optimize=True)
+        os.replace(tmp_name, cache_path)
+        return True
+    except Exception as e:
+        # The cache is only an optimization; the avatar can still be shown
+        print(f"Cannot cache avatar thumbnail {cache_path}: {e}")
+        if tmp_name and os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        return False
+
+
+def _hint_pillow_simd() -> None:
+    '''
+    Print a one-time hint when avatars are resized with stock Pillow on x86-64.
+    Pillow-SIMD is a drop-in replacement (versions carry a ".postN" suffix) whose
+    SSE4/AVX2 resampler is several times faster.
+    '''
+    global _simd_hint_shown
+    if _simd_hint_shown:
+        return
+    _simd_hint_shown = True
+    from PIL import __version__ as pil_version
+    if platform.machine().lower() in ("x86_64", "amd64") and ".post" not in pil_version:
+        print("Tip: install pillow-simd (pip install pillow-simd) for faster avatar resizing.")
+
+
+def _decode_resized_pil(src_path: str, size: int = AVATAR_SIZE):
+    '''
+    Decode the source avatar and downsize it to fit size x size (PIL only, no Tk: thread-safe).
+    The result is written to the on-disk thumbnail cache.
+    '''
+    _pil()
+    src_path = os.path.abspath(src_path)
+    buf = _AVATAR_BYTES.get(src_path)
+    img = Image.open(BytesIO(buf) if buf else src_path)   # lazy: only the header has been read so far
+    _hint_pillow_simd()
+    if img.width * img.height > MAX_AVATAR_PIXELS:
+        img.close()
+        raise ValueError(f"avatar too large ({img.width}x{img.height})")
+    # JPEG sources can be decoded already downscaled by libjpeg (no-op for PNG)
+    img.draft("RGB", (size, size))
+    # thumbnail() keeps the aspect ratio and skips work if the image is already small enough;
+    # BILINEAR is plenty for a 140px avatar and far cheaper than LANCZOS
+    img.thumbnail((size, size), Image.Resampling.BILINEAR)
+    if save_thumbnail(img, thumb_cache_path(src_path, size)):
+        _AVATAR_BYTES.pop(src_path, None)   # later loads use the cached thumbnail instead
+    return img
+
+
+def _ensure_thumbnail(src_path: str, size: int = AVATAR_SIZE) -> bool:
+    '''
+    Make sure the cached thumbnail of an avatar exists, creating it on a miss.
+    Runs in worker threads; returns False instead of raising so one bad file cannot stop the others.
+    '''
+    try:
+        if _fresh_pregen_thumb(src_path, size) is None and not os.path.exists(thumb_cache_path(src_path, size)):
+            _decode_resized_pil(src_path, size).close()   # only the cached file is needed here
+        return True
+    except Exception as e:
+        print(f"Cannot prepare avatar thumbnail for {src_path}: {e}")
+        return False
+
+
+def _load_thumbnail(src_path: str, size: int = AVATAR_SIZE):
+    '''
+    Return a PIL image of the avatar downsized to fit size x size.
+    A shipped pre-sized thumbnail is used when present (no resize at all), then the
+    on-disk thumbnail cache; on a miss the source is resized and cached.
+    '''
+    _pil()
+    thumb = _fresh_pregen_thumb(src_path, size)
+    if thumb:
+        try:
+            img = Image.open(thumb)
+            img.load()
+            return img
+        except Exception as e:
+            # e.g. a Pillow build without WebP support
+            print(f"Cannot load pre-sized avatar {thumb}: {e}")
+    try:
+        img = Image.open(thumb_cache_path(src_path, size))
+        img.load()
+        return img
+    except Exception:
+        # Cache miss (or unreadable cache entry): resize the source and store it
+        return _decode_resized_pil(src_path, size)
+
+
+@lru_cache(maxsize=32)
+def _cached_photo(abs_path: str, size: int, mtime_ns: int, master=None) -> "ImageTk.PhotoImage":
+    '''
+    Return a PhotoImage of the avatar, shared by every login window of the process.
+    mtime_ns is part of the key so an edited file is reloaded. The cache also keeps a
+    strong reference to each PhotoImage, which stops Tk from dropping the image.
+    A PhotoImage belongs to one Tk interpreter, hence the master in the key.
+    '''
+    img = _load_thumbnail(abs_path, size)   # also imports Pillow
+    try:
+        return ImageTk.PhotoImage(img, master=master)   # copies the pixels into the Tk image
+    finally:
+        img.close()   # the PIL buffer is no longer needed, only the Tk image is kept
+
+
+def _sheet_photos(files: List[str], size: int = AVATAR_SIZE, master=None):
+    '''
+    Return PhotoImages for files cut from the shipped sprite sheet (one PNG decode for all
+    avatars), or None if there is no sheet, it is older than a source, or it lists other files.
+    '''
+    if not files:
+        return None
+    sheet = avatar_sheet_path(os.path.dirname(files[0]), size)
+    try:
+        mtime_ns = os.stat(sheet).st_mtime_ns
+        if any(os.stat(f).st_mtime_ns > mtime_ns for f in files):
+            return None   # an avatar was edited after the sheet was generated
+    except OSError:
+        return None
+    return _cached_sheet_photos(sheet, mtime_ns, tuple(files), size, master)
+
+
+@lru_cache(maxsize=2)
+def _cached_sheet_photos(sheet: str, mtime_ns: int, files: tuple, size: int, master=None):
+    '''Decode the sprite sheet once and crop it into per-avatar PhotoImages (cached like _cached_photo)'''
+    _pil()
+    try:
+        with Image.open(sheet) as img:
+            names = img.text.get("avatars", "").split("\n")
+            if names != [os.path.basename(f) for f in files]:
+                return None   # the avatar folder no longer matches the sheet
+            img.load()
+            # crop() of a loaded image is a cheap in-memory copy of one cell
+            return tuple(ImageTk.PhotoImage(img.crop((0, i * size, size, (i + 1) * size)), master=master)
+                         for i in range(len(files)))
+    except Exception as e:
+        print(f"Cannot load avatar sheet {sheet}: {e}")
+        return None
+
+
+@lru_cache(maxsize=8)
+def _fallback_photo(color_hex: str, size: int, master=None) -> tk.PhotoImage:
+    '''
+    Return a solid-colour placeholder avatar (cached per colour and size).
+    A plain Tk photo filled with put() needs no PIL buffer or conversion.
+    '''
+    photo = tk.PhotoImage(width=size, height=size, master=master)
+    photo.put(color_hex, to=(0, 0, size, size))
+    return photo
+
+
 class LoginWindow:
     """
     Login window for chatroom.
@@ -21,6 +288,9 @@ class LoginWindow:
             root: Tkinter root window
         """
         self.root = root
+        # PhotoImages belong to the Tk interpreter, so cache them against the application root
+        # (the same one for every login window opened on a shared root)
+        self._image_master = root.nametowidget(".")
         self.root.title("ChatRoom Login")
         self.root.geometry("1200x800")
         # Allow resizing and start maximized for a full-screen experience
@@ -47,13 +317,21 @@ class LoginWindow:
         self.success = False
         
         # Store PhotoImage to avoid garbage collection and related metadata
-        self.avatar_images: List[ImageTk.PhotoImage] = []
-        self.selected_avatar_border: List[tk.Frame] = []
+        self.avatar_images: List[tk.PhotoImage] = []  # ImageTk or plain Tk photos (placeholders)
+        self.avatar_canvases: List[tk.Canvas] = []  # one per avatar: image item "avatar" + outline item "border"
         self.avatar_files: List[str] = []  # absolute paths of discovered avatar files
+        # Drop this window's image references as soon as it is closed
+        self.root.bind("<Destroy>", self._on_destroy, add="+")
         
         # Create widgets
         self._create_widgets(initial_error=error_message)
         
+    def _on_destroy(self, event):
+        """Release per-window image references when the login window itself is destroyed."""
+        if event.widget is self.root:   # <Destroy> is also delivered for every child widget
+            self.avatar_images.clear()
+            self.avatar_canvases.clear()
+
     def _create_widgets(self, initial_error: Optional[str] = None):
         """
         Create all widgets for login window.
@@ -102,31 +380,39 @@ class LoginWindow:
             # Only clear when a real character is typed; keep placeholder otherwise
             try:
                 if self._name_placeholder_active:
-                    ch = getattr(event, "char", "") # try to get typed character
+                    ch = event.char if event else ""  # typed character (<KeyPress> always provides it)
                     # Printable character triggers removal
                     if ch and ch.isprintable():
                         self.username_entry.delete(0, "end") # remove the placeholder text ' enter your name'
                         self.username_entry.configure(fg=self._name_entry_fg) 
                         self._name_placeholder_active = False
+                        # Placeholder is gone: stop running Python code for every keystroke
+                        self.username_entry.unbind("<KeyPress>")
+                        self.username_entry.unbind("<<Paste>>")
                     elif event and event.keysym in ("BackSpace", "Delete"): 
                         # Ignore delete/backspace while placeholder is visible
                         return "break"
             except Exception:
                 pass
 
+        def _name_bind_placeholder_handlers():
+            self.username_entry.bind("<KeyPress>", _name_remove_placeholder_if_typing) # remove placeholder on typing
+            self.username_entry.bind("<<Paste>>", lambda e: (_name_remove_placeholder_if_typing(e), None)) # handle paste
+
         def _name_focus_out(_e=None):
             # Re-apply placeholder if entry is empty on focus out
             try:
                 if not self.username_entry.get().strip():  # if entry is empty
                     self.username_entry.delete(0, "end")   # clear any whitespace
                     _name_apply_placeholder()  # re-apply placeholder
+                    if self._name_placeholder_active:
+                        _name_bind_placeholder_handlers()  # watch for typing again
             except Exception:
                 pass
 
         # Initialize placeholder and bindings
         _name_apply_placeholder()
-        self.username_entry.bind("<KeyPress>", _name_remove_placeholder_if_typing) # remove placeholder on typing
-        self.username_entry.bind("<<Paste>>", lambda e: (_name_remove_placeholder_if_typing(e), None)) # handle paste
+        _name_bind_placeholder_handlers()
         self.username_entry.bind("<FocusOut>", _name_focus_out) # re-apply placeholder on focus out
         
         # Blue underline below entry username box
@@ -176,47 +462,46 @@ class LoginWindow:
         cols = 4
         count = max(len(self.avatar_files), 2)
 
+        # Each avatar is one Canvas holding the image and its selection outline, so changing the
+        # selection is a cheap item recolour instead of a widget reconfigure + relayout
+        side = AVATAR_SIZE + 2 * (AVATAR_BORDER_WIDTH + AVATAR_PAD)
+        half_border = AVATAR_BORDER_WIDTH / 2
         for i in range(count):
             row = i // cols
             col = i % cols
 
-            # Frame for each avatar (to add border when selected)
-            avatar_frame = tk.Frame(
+            avatar_canvas = tk.Canvas(
                 avatar_grid_frame,
-                bg="#f3f3f3",
-                highlightthickness=4,
-                highlightbackground="#f3f3f3"
+                width=side,
+                height=side,
+                bg="#ffffff",
+                highlightthickness=0,
+                borderwidth=0,
+                cursor="hand2"
             )
-            avatar_frame.grid(row=row, column=col, padx=16, pady=10)
-
-            # Load avatar image
-            if i < len(self.avatar_files):
-                avatar_image = self._load_avatar_image_by_path(self.avatar_files[i])
-                if avatar_image is None:
-                    avatar_image = self._create_fallback_avatar(i)
-            else:
-                avatar_image = self._create_fallback_avatar(i)
+            avatar_canvas.grid(row=row, column=col, padx=16, pady=10)
 
+            # Start with a cheap colour swatch; real images are filled in by _populate_avatars
+            avatar_image = self._create_fallback_avatar(i)
             self.avatar_images.append(avatar_image)
-
-            # Avatar button
-            avatar_btn = tk.Button(
-                avatar_frame,
-                image=avatar_image,
-                cursor="hand2",
-                command=lambda idx=i, frame=avatar_frame: self._select_avatar(idx, frame),
-                relief="flat",
-                bg="#ffffff",
-                activebackground="#f0f0f0"
+            avatar_canvas.create_image(side // 2, side // 2, image=avatar_image, tags="avatar")
+            avatar_canvas.create_rectangle(
+                half_border, half_border, side - half_border, side - half_border,
+                outline=AVATAR_BORDER_IDLE,
+                width=AVATAR_BORDER_WIDTH,
+                tags="border"
             )
-            avatar_btn.pack()
+            avatar_canvas.bind("<Button-1>", lambda e, idx=i, c=avatar_canvas: self._select_avatar(idx, c))
 
-            # Save reference to frame for updating border
-            self.selected_avatar_border.append(avatar_frame)
+            self.avatar_canvases.append(avatar_canvas)
+
+        # Decode the real avatars once the window has been drawn, so it appears immediately
+        # (a short delay rather than after_idle, which can run before the window is mapped)
+        self.root.after(10, lambda: self._populate_avatars(list(self.avatar_canvases)))
 
         # Highlight default avatar (avatar 0) if available
-        if self.selected_avatar_border:
-            self.selected_avatar_border[0].configure(highlightbackground="#2196F3")
+        if self.avatar_canvases:
+            self.avatar_canvases[0].itemconfigure("border", outline=AVATAR_BORDER_SELECTED)
         
         # Login button
         login_btn = tk.Button(
@@ -241,12 +526,47 @@ class LoginWindow:
         except Exception:
             pass
         
+    def _populate_avatars(self, canvases: List[tk.Canvas]):
+        """Replace the placeholder swatches with the real avatar images."""
+        files = self.avatar_files[:len(canvases)]
+        if not files:
+            return
+        _pil()   # import Pillow here, once the window is already on screen (not in the workers)
+        # Shipped sprite sheet: all avatars from a single decode
+        photos = _sheet_photos(files, AVATAR_SIZE, self._image_master)
+        if photos:
+            for i, photo in enumerate(photos):
+                try:
+                    canvases[i].itemconfigure("avatar", image=photo)
+                except tk.TclError:
+                    return   # window was closed in the meantime
+                self.avatar_images[i] = photo
+            return
+
+        # Build missing thumbnails in parallel: Pillow releases the GIL while decoding and
+        # resampling. Only the PhotoImage wrapping below touches Tk, so it stays on this thread.
+        workers = min(8, os.cpu_count() or 1, len(files))
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            list(ex.map(_ensure_thumbnail, files))
+
+        for i, path in enumerate(files):
+            photo = self._load_avatar_image_by_path(path)
+            if photo is None:
+                continue   # keep the fallback swatch
+            try:
+                canvases[i].itemconfigure("avatar", image=photo)
+            except tk.TclError:
+                return   # window was closed in the meantime
+            self.avatar_images[i] = photo
+
     def _load_avatar_image_by_path(self, img_path: str):
-        """Load avatar image from an absolute path and resize to 140x140."""
+        """Load avatar image from an absolute path and resize to 140x140.
+
+        Goes through the process-wide PhotoImage cache, which in turn uses the on-disk thumbnail cache.
+        """
         try:
-            img = Image.open(img_path)
-            img = img.resize((140, 140), Image.Resampling.LANCZOS)
-            return ImageTk.PhotoImage(img)
+            abs_path = os.path.abspath(img_path)
+            return _cached_photo(abs_path, AVATAR_SIZE, os.stat(abs_path).st_mtime_ns, self._image_master)
         except Exception as e:
             print(f"Cannot load avatar from {img_path}: {e}")
             return None
@@ -256,27 +576,29 @@ class LoginWindow:
 
         Files matching pattern 'avatar <number>.png' will be sorted by the number.
         Other png files with 'avatar' prefix are appended afterward in name order.
+        The scan itself is cached until the directory changes (see _discover_avatar_files).
         """
-        # Avatar images are stored under client/img/avatar
-        img_dir = os.path.join(os.path.dirname(__file__), "img", "avatar")
-        files: List[str] = []
         try:
-            for name in os.listdir(img_dir):
-                lower = name.lower()
-                if lower.endswith(('.png', '.jpg', '.jpeg')):
-                    files.append(os.path.join(img_dir, name))
+            files = list(_discover_avatar_files(AVATAR_DIR, os.stat(AVATAR_DIR).st_mtime_ns))
         except Exception as e:
             print(f"Error reading avatar directory: {e}")
             return []
 
-        import re
-        def sort_key(path: str):
-            base = os.path.basename(path).lower()
-            m = re.search(r"avatar\s*(\d+)", base)
-            return (0, int(m.group(1))) if m else (1, base)
-
-        files.sort(key=sort_key)
+        self._buffer_uncached_avatars(files)
         return files
+
+    def _buffer_uncached_avatars(self, files: List[str]):
+        """Keep the raw bytes of avatars without a cached thumbnail in memory (cold start only)."""
+        for path in map(os.path.abspath, files):
+            try:
+                if path in _AVATAR_BYTES or _fresh_pregen_thumb(path) or os.path.exists(thumb_cache_path(path)):
+                    continue
+                if os.path.getsize(path) <= MAX_BUFFERED_AVATAR_BYTES:
+                    with open(path, "rb") as f:
+                        _AVATAR_BYTES[path] = f.read()
+            except Exception:
+                # Decoding falls back to reading the file directly
+                pass
     
     def _create_fallback_avatar(self, index):
         """
@@ -291,23 +613,24 @@ class LoginWindow:
         # Color for each avatar
         colors = ["#FFB6C1", "#ADD8E6"]
         
-        # Create simple image with color
-        img = Image.new("RGB", (140, 140), colors[index % len(colors)])
-        return ImageTk.PhotoImage(img)
+        # Create simple image with color (shared through the fallback cache)
+        return _fallback_photo(colors[index % len(colors)], AVATAR_SIZE, self._image_master)
     
-    def _select_avatar(self, avatar_id, frame):
+    def _select_avatar(self, avatar_id, canvas):
         """
         Handle when user selects an avatar.
         
         Args:
             avatar_id: ID of selected avatar (0-5)
-            frame: Frame containing avatar button (for updating border)
+            canvas: Canvas of the clicked avatar (its "border" item is recoloured)
         """
-        # Remove highlight from old avatar (guard against out-of-range)
+        # Clicking the already selected avatar changes nothing: skip the Tk reconfigure
+        if avatar_id == self.avatar_id:
+            return
+
+        # Only the previously selected outline and the new one are touched
         try:
-            self.selected_avatar_border[self.avatar_id].configure(
-                highlightbackground="#f0f0f0"
-            )
+            self.avatar_canvases[self.avatar_id].itemconfigure("border", outline=AVATAR_BORDER_IDLE)
         except Exception:
             pass
         
@@ -315,11 +638,28 @@ class LoginWindow:
         self.avatar_id = avatar_id
         
         # Highlight new avatar
-        frame.configure(highlightbackground="#2196F3")
+        canvas.itemconfigure("border", outline=AVATAR_BORDER_SELECTED)
 
         # Debug log
         print(f"Selected Avatar index {avatar_id}")
     
+    def _validate(self, username: str) -> Optional[str]:
+        """Return an error message for an invalid username, or None if it is acceptable."""
+        # Valid names (the usual case) are accepted after a single regex scan;
+        # the individual checks below only run to pick the right message
+        if _USERNAME_RE.fullmatch(username):
+            return None
+        if not username:
+            return "Please enter a username!"
+        if len(username) < 2:
+            return "Username must be at least 2 characters!"
+        if len(username) > 20:
+            return "Username must not exceed 20 characters!"
+        # Check special characters
+        if not _USERNAME_CHARS_RE.fullmatch(username):
+            return "Username can only contain letters, numbers, underscores and hyphens!"
+        return None
+
     def _login(self):
         """
         Handle when user clicks Login button or presses Enter.
@@ -332,37 +672,10 @@ class LoginWindow:
         else:
             username = val.strip()  # remove the leading/trailing whitespace
         
-        # Validate username
-        if not username:
-            messagebox.showerror(
-                "Error",
-                "Please enter a username!"
-            )
-            self.username_entry.focus()
-            return
-        
-        if len(username) < 2:
-            messagebox.showerror(
-                "Error",
-                "Username must be at least 2 characters!"
-            )
-            self.username_entry.focus()
-            return
-        
-        if len(username) > 20:
-            messagebox.showerror(
-                "Error",
-                "Username must not exceed 20 characters!"
-            )
-            self.username_entry.focus()
-            return
-        
-        # Check special characters
-        if not username.replace("_", "").replace("-", "").replace(" ", "").isalnum():
-            messagebox.showerror(
-                "Error",
-                "Username can only contain letters, numbers, underscores and hyphens!"
-            )
+        # Validate username (shown inline, no modal dialog)
+        err = self._validate(username)
+        if err:
+            self.show_error(err)
             self.username_entry.focus()
             return
         
@@ -373,17 +686,27 @@ class LoginWindow:
         self.root.destroy()
 
 
-def show_login(error_message: Optional[str] = None):
+def show_login(error_message: Optional[str] = None, root: Optional[tk.Tk] = None):
     """
     Display login window and return username + avatar_id.
+
+    Args:
+        error_message: optional error shown under the name field (e.g. duplicate username)
+        root: existing (usually withdrawn) Tk root to reuse; the login window is then a
+              Toplevel of it, so no second Tcl interpreter is created for the chat window
     
     Returns:
         tuple: (username, avatar_id) if login successful
         tuple: (None, None) if user closes window
     """
-    root = tk.Tk()
-    login_window = LoginWindow(root, error_message)
-    root.mainloop()  # block execution until window is closed 
+    if root is None:
+        root = tk.Tk()
+        login_window = LoginWindow(root, error_message)
+        root.mainloop()  # block execution until window is closed 
+    else:
+        win = tk.Toplevel(root)
+        login_window = LoginWindow(win, error_message)
+        root.wait_window(win)  # block until the login window is destroyed
     
     if login_window.success:
         return login_window.username, login_window.avatar_id
@@ -3,8 +3,8 @@ Main entry point for chatroom client.
 Display login window first, then connect and open chat UI.
 """
 import argparse
+import tkinter as tk
 from .net import NetClient, DuplicateUsernameError
-from .ui import ChatUI
 from .login import show_login
 
 
@@ -22,20 +22,28 @@ def main():
     ap.add_argument("--port", type=int, default=5050, help="Server port")
     args = ap.parse_args()
 
+    # One Tk root (Tcl interpreter) for the whole session; it stays hidden and the
+    # login and chat windows are Toplevels on it
+    root = tk.Tk()
+    root.withdraw()
+
     # Step 1(+2 pre-check): Loop login until we can connect without duplicate username
     error_msg = None
     while True:
-        username, avatar_id = show_login(error_message=error_msg)
+        username, avatar_id = show_login(error_message=error_msg, root=root)
         # If user closes login window (no login), exit program
         if username is None:
             print("Login cancelled. Exiting program.")
+            root.destroy()
             return
 
         # Try to connect using provided username
         # Don't attach a handler yet - let messages backlog until UI is created
         net = NetClient(args.host, args.port, username, on_message=None, avatar_id=avatar_id)
         try:
-            net.connect()
+            # Only the quick part (TCP + auth) runs before the chat window is shown;
+            # the RSA key exchange is finished in the background below
+            net.connect_transport()
             break
         except DuplicateUsernameError:
             # Show error message inline and let user retry
@@ -45,13 +53,16 @@ def main():
     print(f"Connected as user: {username}, avatar: {avatar_id + 1}")
 
     # Step 3: Create UI after successful connection
-    ui = ChatUI(username, net, avatar_id)
+    # (imported only now: ui loads Pillow and emoji, which the login window does not need up front)
+    from .ui import ChatUI
+    ui = ChatUI(root, username, net, avatar_id)
+    net.finish_handshake(background=True)
     
-    # Setup window close handler
-    ui.protocol("WM_DELETE_WINDOW", lambda: (net.close(), ui.destroy()))   # on close , close the net and destrou UI
+    # Setup window close handler (destroying the hidden root also closes the chat window)
+    ui.protocol("WM_DELETE_WINDOW", lambda: (net.close(), root.destroy()))   # on close , close the net and destroy UI
     
     # Start UI main loop
-    ui.mainloop() # run forever UI loop
+    root.mainloop() # run forever UI loop
 
 
 if __name__ == "__main__":
@@ -1,19 +1,144 @@
-import socket, threading, datetime, json, os
-from queue import Queue
+import selectors, socket, struct, threading, json, os, uuid
+from collections import deque
+from functools import lru_cache
+from queue import Queue, Empty
 from typing import Optional, Callable, Dict, Any, List
 
-from common.protocol import send_json, recv_json
-from common.crypto import aes_key, rsa_wrap_key, encrypt_body, decrypt_body
+from common.protocol import (send_json, recv_json, encode_json_body, take_buffered, release_buffered,
+                             send_parts, send_parts_nowait, binary_frame_parts, FrameBuffer, iso_now, iso_now_bytes,
+                             DELIM)
+from common.crypto import aes_key, aes_cipher, aes_encrypt_b64, rsa_wrap_key, encrypt_body, decrypt_body, b64_bytes
 
 ENC = "utf-8"
+SEND_COALESCE_BYTES = 256 * 1024   # file-chunk frames are batched into one write until this much is pending
+RX_BUF_SIZE = 256 * 1024   # initial receive buffer; grows (up to MAX_FRAME) for longer messages
+SEND_HIGH_WATER = 1024 * 1024   # senders (except the loop thread) wait while more than this is unsent
+SOCK_BUF_BYTES = 1 << 20   # requested SO_SNDBUF/SO_RCVBUF, to keep bulk file transfers from stalling
+BACKLOG_MAX = 1024   # messages kept while no UI handler is attached; older ones are dropped beyond that
+FILE_SEND_QUEUE = 8   # encrypted file chunks the reader/encryptor thread may run ahead of the writer
+FILE_SEND_BATCH = 8   # ready chunks the writer hands to the socket in one scatter-gather write
+CHUNK_POOL_MAX = 4    # idle upload read buffers kept per chunk size for the next uploads
+# Plaintext header of a file_chunk_bin body (file id as UUID bytes, seq, final); the raw
+# chunk bytes follow it. Sent only to receivers whose file_ack says "binary": true
+FILE_CHUNK_HEADER = struct.Struct("<16sI?")
+
+# Free list of upload read buffers by size: back-to-back uploads (or one file offered to several
+# users) reuse them instead of allocating a new chunk-sized buffer each time
+_chunk_pool: Dict[int, List[bytearray]] = {}
+_chunk_pool_lock = threading.Lock()
+
+def _take_chunk_buffer(size: int) -> bytearray:
+    ''' A bytearray of exactly size bytes, from the pool if one is free '''
+    with _chunk_pool_lock:
+        free = _chunk_pool.get(size)
+        if free:
+            return free.pop()
+    return bytearray(size)
+
+def _return_chunk_buffer(buf: bytearray):
+    ''' Give a buffer from _take_chunk_buffer back (dropped if the pool is full) '''
+    with _chunk_pool_lock:
+        free = _chunk_pool.setdefault(len(buf), [])
+        if len(free) < CHUNK_POOL_MAX:
+            free.append(buf)
+
+# One selector loop on one hidden thread serves every NetClient in the process,
+# instead of one blocking OS thread per connection
+_sel: Optional[selectors.BaseSelector] = None
+_sel_thread: Optional[threading.Thread] = None
+_sel_lock = threading.Lock()
+_sel_calls: "deque[Callable[[], None]]" = deque()   # work handed to the loop thread by other threads
+_wake_r: Optional[socket.socket] = None   # socketpair used to interrupt select() when _sel_calls is fed
+_wake_w: Optional[socket.socket] = None
+
+
+def _call_in_loop(fn: Callable[[], None]) -> None:
+    ''' Run fn on the selector thread (which is started on first use) '''
+    global _sel, _sel_thread, _wake_r, _wake_w
+    with _sel_lock:
+        if _sel is None:
+            _sel = selectors.DefaultSelector()
+            _wake_r, _wake_w = socket.socketpair()
+            _wake_r.setblocking(False)
+            _wake_w.setblocking(False)
+            _sel.register(_wake_r, selectors.EVENT_READ, None)
+            _sel_thread = threading.Thread(target=_run_loop, name="net-io", daemon=True)
+            _sel_thread.start()
+    _sel_calls.append(fn)
+    try:
+        _wake_w.send(b"\0")
+    except BlockingIOError:
+        pass   # a wake-up is already pending
+
+
+def _run_loop() -> None:
+    ''' Selector thread: dispatch socket readiness to the NetClient registered as key.data '''
+    while True:
+        for key, events in _sel.select():
+            client = key.data
+            if client is None:   # wake-up byte(s): run the queued calls
+                try:
+                    while _wake_r.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                while _sel_calls:
+                    try:
+                        _sel_calls.popleft()()
+                    except Exception as e:
+                        print(f"Network loop error: {e}")
+                continue
+            if events & selectors.EVENT_READ:
+                client._on_readable()
+            if events & selectors.EVENT_WRITE and client.sock is not None:
+                client._on_writable()
+
+
+@lru_cache(maxsize=256)
+def _json_str(s: str) -> bytes:
+    '''
+    A string as a JSON string literal in UTF-8. The same few values (usernames, the id of the
+    file being uploaded) are spliced into every hand-built frame, so each is encoded only once.
+    '''
+    return json.dumps(s, ensure_ascii=False).encode(ENC)
+
+
+def _uuid_bytes(file_id: str) -> Optional[bytes]:
+    ''' 16-byte form of a file id, or None if it is not a UUID string that str(uuid) gives back '''
+    try:
+        u = uuid.UUID(file_id)
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return u.bytes if str(u) == file_id else None
+
+def file_offer_meta(path: str, size: int, file_id: str, chunk_size: int = 0) -> dict:
+    '''
+    File metadata sent in a file_offer: name, size, type (extension without dot) and file_id,
+    plus the bytes per chunk of the upload if known (lets the receiver place chunk seq at
+    seq * chunk_size in its file)
+    '''
+    filename = os.path.basename(path)   # Get the name of file ( ex: "document.pdf" )
+    ext = os.path.splitext(filename)[1]
+    meta = {"name": filename, "size": size, "type": ext[1:] or "unknown", "file_id": file_id}
+    if chunk_size:
+        meta["chunk"] = chunk_size
+    return meta
 
 
 class DuplicateUsernameError(Exception):
     """Raised when the server rejects an auth because the username is already in use."""
     pass
 
+
 class NetClient:
     ''' Network client for chat application '''
+    # Fixed attribute layout: faster attribute access on the per-message send/receive paths
+    # and no per-instance __dict__
+    __slots__ = ("host", "port", "username", "avatar_id", "sock", "_on_message", "_backlog", "_backlog_lock", "_backlog_dropped",
+                 "session_key", "session_cipher", "_rx", "_out", "_out_cond", "_send_buf", "_send_buf_bytes", "_send_lock", "running",
+                 "sndbuf", "rcvbuf", "_server_pub", "_handshake_done", "_env_templates", "_frame_prefixes",
+                 "_inbox", "_dispatch_thread")
+
     def __init__(self, host: str, port: int, username: str,
                  on_message: Optional[Callable[[Dict[str,Any]], None]] = None,
                  avatar_id: int = 0):
@@ -22,12 +147,33 @@ class NetClient:
         self.sock: Optional[socket.socket] = None
         # Backlog messages until UI attaches the handler; then flush
         self._on_message: Optional[Callable[[Dict[str,Any]], None]] = None   # when a message is received, this function will be called
-        self._backlog: List[Dict[str,Any]] = []   # store message received before UI attaches
+        self._backlog: "deque[Dict[str,Any]]" = deque(maxlen=BACKLOG_MAX)   # store message received before UI attaches
+        self._backlog_dropped = 0   # messages pushed out of the full backlog (reported once on replay)
+        self._backlog_lock = threading.Lock()   # guards _backlog and the handoff to _on_message
+        self._inbox: Queue = Queue()   # messages for the on_message callback (see _dispatch_loop)
+        self._dispatch_thread: Optional[threading.Thread] = None
         if on_message:
             self.on_message = on_message
         self.session_key: Optional[bytes] = None   # AES session key after key-exchange
-        self.recv_thread: Optional[threading.Thread] = None   # thread for receiving messages
+        self.session_cipher = None   # AESGCM object of session_key, built once and used for every message
+        self._rx: Optional[FrameBuffer] = None   # set once the socket is handed to the selector loop
+        self._out = bytearray()                    # bytes accepted by _write but not sent yet
+        self._out_cond = threading.Condition()     # guards _out; notified when it drains
+        self._send_buf: List[bytes] = []      # framed file chunks not written yet (see _send(defer=True))
+        self._send_buf_bytes = 0              # total length of _send_buf
+        self._send_lock = threading.Lock()    # guards _send_buf (UI thread and event loop thread both send)
         self.running = False
+        self.sndbuf = 0   # socket buffer sizes the kernel actually granted (read back after connecting)
+        self.rcvbuf = 0
+        self._server_pub: Optional[str] = None   # server's RSA public key (PEM), from connect_transport
+        self._handshake_done = threading.Event()   # set once the wrapped session key has been sent
+        # One pre-built envelope per message kind; _envelope copies it (a plain dict copy
+        # reuses the key hashes) instead of building the dict literal on every send
+        self._env_templates: Dict[str, Dict[str, Any]] = {
+            kind: {"type": kind, "sender": username, "to": None, "ts": "", "payload": None}
+            for kind in ("pub", "priv", "file_offer", "file_chunk", "file_ack")
+        }
+        self._frame_prefixes: Dict[tuple, bytes] = {}   # (kind, recipient) -> encoded start of an envelope
 
     @property
     def on_message(self) -> Optional[Callable[[Dict[str,Any]], None]]:
@@ -38,28 +184,44 @@ class NetClient:
     def on_message(self, cb: Optional[Callable[[Dict[str,Any]], None]]):
         '''
         Set the callback for incoming messages. If there are any backlog messages received before
-        the UI attached, flush them now.
+        the UI attached, they are queued for it now (delivered on the dispatch thread, like all others).
         Input:
             - cb: callback function that accepts a message environment dict
         '''
-        self._on_message = cb
-        # Flush any messages received before the UI attached
-        if cb and self._backlog:  # If there are pending messages, replay them
-            pending = self._backlog # make copy of temporary backlog( including old messages )
-            self._backlog = [] # clear the main backlog immediately to avoid duplication
-            for env in pending:  # loop through the pending (including old messages) 
-                try:
-                    cb(env)   # call newly provided function for each pending(old) message
-                except Exception:
-                    # Ignore UI errors to avoid breaking network thread
-                    pass
+        with self._backlog_lock:
+            if not cb:
+                self._on_message = None
+                return
+            # Queue the messages received before the UI attached ahead of any new one: _dispatch
+            # reads the handler under this lock and only queues after it, so order is kept
+            if self._backlog_dropped:
+                # A single notice instead of the lost messages
+                self._inbox.put((cb, {"type":"system","sender":None,"to":"*","ts":self.iso_now(),
+                                      "payload":{"text":f"{self._backlog_dropped} earlier message(s) were dropped while the chat window was not ready."}}))
+                self._backlog_dropped = 0
+            for env in self._backlog:
+                self._inbox.put((cb, env))
+            self._backlog.clear()
+            self._start_dispatch()
+            self._on_message = cb
 
     def iso_now(self):
-        return datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        ''' Current UTC time as ISO string (common.protocol.iso_now, cached per second) '''
+        return iso_now()
 
     def connect(self):
+        ''' Connect, authenticate and finish the key exchange (blocking) '''
+        self.connect_transport()
+        self.finish_handshake()
+
+    def connect_transport(self):
+        '''
+        First, fast half of connect(): TCP connection, auth and the server's reply.
+        Raises DuplicateUsernameError / RuntimeError if the server rejects the login, so the
+        caller can show the error before anything else is set up.
+        '''
         # Establish a TCP connection to the chat server.
-        self.sock = socket.create_connection((self.host, self.port))
+        self.sock = self._open_socket()
         self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # Disable Nagle's algorithm: send any data immediately
         # Send auth with avatar_id and username to server
         send_json(self.sock, {"type":"auth","sender":None,"to":None,"ts":self.iso_now(),
@@ -80,89 +242,472 @@ class NetClient:
             else:
                 raise RuntimeError(f"Server error: {code}")
         # Expecting server's RSA public key
-        server_pub = env["payload"]["server_pub_pem"] # get user's RSA public key in PEM format
+        self._server_pub = env["payload"]["server_pub_pem"] # get user's RSA public key in PEM format
+
+    def _open_socket(self) -> socket.socket:
+        '''
+        Like socket.create_connection, but with larger send/receive buffers set before connect()
+        (the receive buffer size decides the TCP window scale, which is fixed at the handshake).
+        '''
+        err = None
+        for family, type_, proto, _, addr in socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM):
+            sock = socket.socket(family, type_, proto)
+            try:
+                for opt in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+                    try:
+                        sock.setsockopt(socket.SOL_SOCKET, opt, SOCK_BUF_BYTES)
+                    except OSError:
+                        pass   # keep the system default
+                sock.connect(addr)
+            except OSError as e:
+                sock.close()
+                err = e
+                continue
+            self.sndbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+            self.rcvbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+            return sock
+        raise err or OSError(f"cannot resolve {self.host}")
+
+    def finish_handshake(self, background: bool = False):
+        '''
+        Second half of connect(): RSA-wrap a fresh AES session key, start receiving and send the key.
+        With background=True this runs on a worker thread so the caller (the UI) is not blocked;
+        sends made meanwhile wait until the key has been sent, and a failure is reported to
+        on_message as a disconnect.
+        '''
+        if background:
+            threading.Thread(target=self._finish_handshake_bg, name="net-handshake", daemon=True).start()
+            return
+        server_pub = self._server_pub
         # Generate AES key
         self.session_key = aes_key()
+        self.session_cipher = aes_cipher(self.session_key)
         # Encrypt the session AES key with server's RSA public key
         wrapped = rsa_wrap_key(server_pub, self.session_key)
         # Start listening for incoming messages BEFORE sending wrapped key
-        # so we catch the immediate "joined" system notification and userlist
+        # so we catch the immediate "joined" system notification and userlist.
+        # From here on the socket is non-blocking and driven by the shared selector loop.
         self.running = True
-        self.recv_thread = threading.Thread(target=self._recv_loop, daemon=True)
-        self.recv_thread.start()
+        self._rx = FrameBuffer(take_buffered(self.sock), RX_BUF_SIZE)
+        self.sock.setblocking(False)
+        _call_in_loop(self._attach)
         # Send wrapped encrypted AES key to server ( including AES session key )
-        send_json(self.sock, {"type":"key","sender":self.username,"to":None,"ts":self.iso_now(),
-                              "payload":{"wrapped": wrapped}})
+        self._send({"type":"key","sender":self.username,"to":None,"ts":self.iso_now(),
+                    "payload":{"wrapped": wrapped}})
+        self._handshake_done.set()
+
+    def _finish_handshake_bg(self):
+        try:
+            self.finish_handshake()
+        except Exception as e:
+            print(f"Key exchange failed: {e}")
+            if self._rx is not None:
+                # Already handed to the selector loop: the normal teardown unregisters, closes
+                # and reports the disconnect (queued behind _attach, so it runs after it)
+                _call_in_loop(self._teardown)
+            else:
+                try:
+                    if self.sock:
+                        self.sock.close()
+                except Exception:
+                    pass
+                self.sock = None
+                self._on_disconnect()
+            self.session_cipher = None   # no session: senders must not go ahead meanwhile
+            self._handshake_done.set()   # unblock waiting senders; they fail on the missing key or socket
+
+    def _wait_handshake(self):
+        ''' Block a sender until the session key is known and sent; fail if there is no session '''
+        if not self._handshake_done.is_set():
+            self._handshake_done.wait()
+        if self.sock is None or self.session_cipher is None:
+            raise ConnectionError("not connected")
+
+    def _attach(self):
+        ''' Register the socket with the selector (runs on the loop thread) '''
+        _sel.register(self.sock, selectors.EVENT_READ, self)
+        if len(self._rx):
+            self._on_readable(0)   # leftover handshake bytes may already hold messages
+
+    def _on_readable(self, nbytes: Optional[int] = None):
+        ''' Selector callback: receive what is available and dispatch every complete message '''
+        if self.sock is None:   # closed earlier in the same select() round
+            return
+        try:
+            if nbytes is None:
+                nbytes = self.sock.recv_into(self._rx.get_buffer())
+                if nbytes == 0:
+                    raise ConnectionError("socket closed")
+            for env in self._rx.frames(nbytes):
+                self._dispatch(env)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except Exception:
+            # Socket closed, bad data or a failing handler: treat it like a broken connection
+            self._teardown()
+
+    def _on_writable(self):
+        ''' Selector callback: push queued bytes; stop watching for writability once empty '''
+        with self._out_cond:
+            try:
+                sent = self.sock.send(self._out)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self._out.clear()
+                self._out_cond.notify_all()
+                self._teardown()
+                return
+            del self._out[:sent]
+            if not self._out:
+                _sel.modify(self.sock, selectors.EVENT_READ, self)
+            if len(self._out) <= SEND_HIGH_WATER:
+                self._out_cond.notify_all()
+
+    def _teardown(self):
+        ''' Unregister and close the socket, then tell the UI (runs on the loop thread) '''
+        with self._out_cond:
+            sock, self.sock = self.sock, None
+            self._out_cond.notify_all()   # release senders waiting for the queue to drain
+        if sock is None:
+            return
+        try:
+            _sel.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            sock.close()
+        except Exception:
+            pass
+        self._on_disconnect()
+
+    def _send(self, env: Dict[str, Any], defer: bool = False):
+        '''
+        Send one envelope. Safe to call from any thread: from the UI thread it blocks until the
+        data is handed to the socket (like sendall did); on the event loop thread itself
+        (e.g. from an on_message callback) it only queues the data, since waiting would deadlock.
+        With defer=True the frame is only appended to a buffer, which is written in one go once
+        SEND_COALESCE_BYTES are pending or with the next non-deferred send (order is kept).
+        '''
+        self._send_encoded(encode_json_body(env), defer)
+
+    def _send_encoded(self, body: bytes, defer: bool = False):
+        ''' _send for an envelope that is already JSON-encoded (body without the delimiter) '''
+        self._send_batch(((body, DELIM),), defer)
+
+    def _send_batch(self, frames, defer: bool = False):
+        '''
+        Send several frames at once: they go out together in one write. Each frame is a sequence
+        of buffers that is complete on its own ((body, DELIM) for JSON, or binary_frame_parts).
+        '''
+        with self._send_lock:
+            # Frames are kept as separate buffers and written with one scatter-gather call
+            for frame in frames:
+                self._send_buf += frame
+                self._send_buf_bytes += sum(map(len, frame))
+            if defer and self._send_buf_bytes < SEND_COALESCE_BYTES:
+                return
+            parts, self._send_buf, self._send_buf_bytes = self._send_buf, [], 0
+            self._write(parts)   # still under _send_lock, so frames from different threads stay in order
+        self._wait_drained()
+
+    def flush(self):
+        ''' Write any deferred frames now '''
+        with self._send_lock:
+            parts, self._send_buf, self._send_buf_bytes = self._send_buf, [], 0
+            if not parts:
+                return
+            self._write(parts)
+        self._wait_drained()
+
+    def _write(self, parts: List[bytes]):
+        '''
+        Hand already framed bytes to the socket, without waiting (the caller holds _send_lock).
+        Whatever the kernel does not take right away is queued and sent by the selector loop.
+        '''
+        if self._rx is None:  # handshake still running on the plain blocking socket
+            send_parts(self.sock, parts)
+            return
+        on_loop = threading.current_thread() is _sel_thread
+        with self._out_cond:
+            if self.sock is None:
+                raise ConnectionError("socket closed")
+            if not self._out:
+                parts = send_parts_nowait(self.sock, parts)
+                if not parts:
+                    return
+                # Let the loop send the rest as the socket drains
+                if on_loop:
+                    _sel.modify(self.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, self)
+                else:
+                    sock = self.sock
+                    _call_in_loop(lambda: self.sock is sock and
+                                  _sel.modify(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, self))
+            for part in parts:
+                self._out += part
+
+    def _wait_drained(self):
+        '''
+        Backpressure like sendall: other threads wait while more than SEND_HIGH_WATER is queued.
+        The loop thread itself never waits, and nobody waits holding _send_lock, as the loop
+        thread may need it to send from a callback.
+        '''
+        if self._rx is None or threading.current_thread() is _sel_thread:
+            return
+        with self._out_cond:
+            while self.sock is not None and len(self._out) > SEND_HIGH_WATER:
+                self._out_cond.wait()
+
+    def _envelope(self, kind: str, to: Optional[str], payload: Dict[str, Any]) -> Dict[str, Any]:
+        ''' Return a fresh envelope of the given kind from its template (safe to hand to another thread) '''
+        env = self._env_templates[kind].copy()
+        env["to"] = to
+        env["ts"] = self.iso_now()
+        env["payload"] = payload
+        return env
+
+    def begin_burst(self):
+        '''
+        Start a burst of related sends (e.g. all chunks of a file): let the kernel build
+        full-sized packets instead of pushing every write out on its own.
+        Uses TCP_CORK on Linux; elsewhere Nagle is re-enabled for the duration of the burst.
+        '''
+        try:
+            if hasattr(socket, "TCP_CORK"):
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+            else:
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 0)
+        except (OSError, AttributeError):
+            pass   # purely an optimization
+
+    def end_burst(self):
+        ''' End a burst started with begin_burst: send whatever is still held back right away '''
+        try:
+            if hasattr(socket, "TCP_CORK"):
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+            else:
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
 
     def close(self):
         try:
-            if self.sock: # if socket exists
-                send_json(self.sock, {"type":"system","sender":self.username,"to":None,"ts":self.iso_now(),
-                                      "payload":{"event":"leave"}})   # notify server we are leaving
+            if self.sock: # if socket exists (the leave message also flushes deferred chunks)
+                self._send({"type":"system","sender":self.username,"to":None,"ts":self.iso_now(),
+                            "payload":{"event":"leave"}})   # notify server we are leaving
         except Exception:
             pass
         self.running = False
         try:
-            if self.sock: self.sock.close()
+            if self._rx is not None:
+                # Give queued data (e.g. the leave message) a moment to go out, then
+                # close on the loop thread, which owns the socket now
+                if threading.current_thread() is not _sel_thread:
+                    with self._out_cond:
+                        self._out_cond.wait_for(lambda: not self._out or self.sock is None, timeout=2.0)
+                _call_in_loop(self._teardown)
+            elif self.sock:
+                release_buffered(self.sock)   # handshake not finished: recv_json may hold its bytes
+                self.sock.close()
         except Exception:
             pass
 
 
     def send_public(self, text: str):
         ''' Send a public message to all users '''
-        body = {"text": text}
-        env = {"type":"pub","sender":self.username,"to":"*","ts":self.iso_now(),
-               "payload": encrypt_body(self.session_key, body)}
-        send_json(self.sock, env)
+        self._wait_handshake()
+        self._send_encoded(self._encrypted_frame("pub", "*", encode_json_body({"text": text})))
 
     def send_private(self, to_user: str, text: str):
         ''' Send a private message to a specific user '''
-        body = {"text": text}
-        env = {"type":"priv","sender":self.username,"to":to_user,"ts":self.iso_now(),
-               "payload": encrypt_body(self.session_key, body)}
-        send_json(self.sock, env)
+        self._wait_handshake()
+        self._send_encoded(self._encrypted_frame("priv", to_user, encode_json_body({"text": text})))
 
-    def send_file_offer(self, to_user: str, path: str, size: int, file_id: str):
+    def send_file_offer(self, to_user: str, path: str, size: int, file_id: str, meta: Optional[dict] = None):
         ''' Send a file offer to a specific user (or broadcast with to_user="*")
             Includes a stable file_id so receivers can request the correct file.
             Includes file metadata: name, size, type (extension)
+            Callers that already built the metadata (see file_offer_meta) can pass it as meta.
         '''
-        import os.path
-        filename = os.path.basename(path)   # Get the name of file ( ex: "document.pdf" )
-        # Get file extension/type
-        _, ext = os.path.splitext(filename)   # split into (root, ext)
-        file_type = ext[1:] if ext else "unknown"  # get file type without dot
-        
-        meta = {
-            "name": filename,
-            "size": size,
-            "type": file_type,
-            "file_id": file_id
-        }
-        env = {"type":"file_offer","sender":self.username,"to":to_user,"ts":self.iso_now(),
-               "payload": encrypt_body(self.session_key, meta)}
-        send_json(self.sock, env)
+        if meta is None:
+            meta = file_offer_meta(path, size, file_id)
+        self._wait_handshake()
+        env = self._envelope("file_offer", to_user, encrypt_body(self.session_cipher, meta))
+        self._send(env)
 
     def send_file_chunk(self, to_user: str, file_id: str, seq: int, chunk, final: bool):
         '''
-        This function sends a file chunk to a specific user. Accepts bytes or str for chunk.
+        This function sends a file chunk to a specific user.
         Input:
             - to_user: recipient username
             - file_id: unique identifier for the file transfer session
             - seq: sequence number of this chunk
-            - chunk: bytes or str data of the chunk
+            - chunk: bytes of the chunk; any bytes-like object works (e.g. a memoryview slice of a
+              reused read buffer), it is encoded into the frame before this returns
             - final: boolean indicating if this is the final chunk
         Output: sends a "file_chunk" message to the server      
         '''
-        if isinstance(chunk, bytes): # if chunk is bytes, decode it
-            data_str = chunk.decode("latin1")
+        # Consecutive chunks are batched into fewer, larger writes; the final one flushes the batch
+        self._send_encoded(self._file_chunk_frame(to_user, file_id, seq, chunk, final), defer=not final)
+
+    def _file_chunk_frame(self, to_user: str, file_id: str, seq: int, chunk: "bytes | memoryview", final: bool) -> bytes:
+        '''
+        Build, encrypt and JSON-encode one file_chunk envelope (no socket access, any thread).
+        This is the hot path of uploads, so the JSON text is written directly as bytes: the same
+        message _envelope + encrypt_body + encode_json_body would produce (same keys and order),
+        without the intermediate dicts, str conversions and JSON encoder passes.
+        '''
+        self._wait_handshake()
+        # Base64 keeps the JSON text pure ASCII (one byte per char); latin1 text doubled every
+        # byte >= 0x80 when encoded as UTF-8
+        # b64_bytes reads the buffer in place (no bytes() copy of a memoryview chunk)
+        plain = b'{"id":%s,"seq":%d,"final":%s,"encoding":"base64","data":"%s"}' % (
+            _json_str(file_id), seq, b"true" if final else b"false", b64_bytes(chunk))
+        return self._encrypted_frame("file_chunk", to_user, plain)
+
+    def _file_chunk_bin_frame(self, to_user: str, plain: "bytes | memoryview") -> list:
+        '''
+        Same as _file_chunk_frame for a receiver that accepts binary chunks, as the buffers of one
+        binary frame (see common.protocol.binary_frame_parts). The encrypted body, plain, is a
+        FILE_CHUNK_HEADER followed by the chunk bytes (start_file_sender reads each chunk in right
+        behind its header, so this needs no join copy), and its ciphertext goes on the wire as raw
+        bytes after a small JSON header: nothing is Base64-coded, escaped or searched for \n.
+        '''
+        self._wait_handshake()
+        nonce = os.urandom(12)
+        data = self.session_cipher.encrypt(nonce, plain, b"")   # ciphertext + tag, as encrypt_bin
+        header = b"".join((self._frame_prefix("file_chunk_bin", to_user), iso_now_bytes(),
+                           b'","payload":{"bin":{"n":"', b64_bytes(nonce), b'"}}}'))
+        return binary_frame_parts(header, data)
+
+    def _frame_prefix(self, kind: str, to: str) -> bytes:
+        '''
+        The start of an envelope that never changes for a (kind, recipient) pair - type, our
+        username and the recipient, already JSON-escaped - up to the opening quote of "ts";
+        encoded once and reused
+        '''
+        prefix = self._frame_prefixes.get((kind, to))
+        if prefix is None:
+            prefix = self._frame_prefixes[kind, to] = b'{"type":"%s","sender":%s,"to":%s,"ts":"' % (
+                kind.encode(), _json_str(self.username), _json_str(to))
+        return prefix
+
+    def _encrypted_frame(self, kind: str, to: str, plain: bytes) -> bytes:
+        '''
+        Encrypt a JSON-encoded body and write the whole envelope as bytes. The constant start
+        comes from _frame_prefix; only ts and the Base64 payload (which never need escaping)
+        are filled in per frame.
+        '''
+        n, c, t = aes_encrypt_b64(self.session_cipher, plain)
+        return b"".join((self._frame_prefix(kind, to), iso_now_bytes(), b'","payload":{"enc":{"n":"', n,
+                         b'","c":"', c, b'","t":"', t, b'"}}}'))
+
+    def start_file_sender(self, to_user: str, file_id: str, path: str, chunk_size: int,
+                          on_done: Optional[Callable[[Optional[Exception]], None]] = None,
+                          binary: bool = False) -> threading.Thread:
+        '''
+        Upload a file in the background as file_chunk messages, the last one with final=True.
+        One thread reads and encrypts chunks into a small bounded queue while a second one writes
+        them to the socket, so disk reads, AES and network I/O overlap; the bounded queue keeps
+        the reader at most FILE_SEND_QUEUE chunks ahead.
+        Input:
+            - to_user: recipient username
+            - file_id: unique identifier for the file transfer session
+            - path: file to send
+            - chunk_size: bytes of file data per chunk
+            - on_done: called (on the writer thread) with None on success or the exception
+            - binary: send file_chunk_bin binary frames (the receiver's file_ack allowed it)
+        Output: the writer thread (already started)
+        '''
+        fid_bytes = _uuid_bytes(file_id) if binary else None
+        # make_frame(seq, view, n, final): the chunk is view[head:head + n]
+        if fid_bytes is not None:
+            head = FILE_CHUNK_HEADER.size   # room for the chunk's header in front of its data
+            def make_frame(seq, view, n, final):
+                FILE_CHUNK_HEADER.pack_into(view, 0, fid_bytes, seq, final)
+                return self._file_chunk_bin_frame(to_user, view[:head + n])
         else:
+            head = 0
+            make_frame = lambda seq, view, n, final: (self._file_chunk_frame(to_user, file_id, seq, view[:n], final), DELIM)
+        q: Queue = Queue(maxsize=FILE_SEND_QUEUE)
+        stop = threading.Event()   # set by the writer when it is done or gives up
 
-            data_str = chunk
-        body = {"id": file_id, "seq": seq, "final": final, "data": data_str}
-        env = {"type":"file_chunk","sender":self.username,"to":to_user,"ts":self.iso_now(),
-               "payload": encrypt_body(self.session_key, body)}
-        send_json(self.sock, env)
+        def put(item):
+            # Plain blocking put, no timed polling: once the writer sets stop it empties the
+            # queue, so a reader blocked here wakes up, and sees stop before the next put
+            if stop.is_set():
+                return False
+            q.put(item)
+            return True
+
+        def produce():
+            seq = 0
+            buf = _take_chunk_buffer(head + chunk_size)   # reused: each chunk is encoded into its frame before the next read
+            view = memoryview(buf)
+            data = view[head:]
+            try:
+                # Unbuffered, so readinto() copies from the kernel straight into buf
+                with open(path, "rb", buffering=0) as f:
+                    if hasattr(os, "posix_fadvise"):
+                        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)   # read-ahead hint
+                    size, pos = os.fstat(f.fileno()).st_size, 0
+                    while True:
+                        n = f.readinto(data)
+                        pos += n
+                        # The chunk that reaches the known size is the final one, so no extra read
+                        # and empty frame at the end (an empty final still covers a file that shrank)
+                        final = not n or pos >= size
+                        if not put((make_frame(seq, view, n, final), final)) or final:
+                            return
+                        seq += 1
+            except Exception as e:
+                put(e)
+            finally:
+                data.release()
+                view.release()
+                _return_chunk_buffer(buf)
+
+        def consume():
+            error = None
+            self.begin_burst()   # chunks go out as full packets, not one push per chunk
+            try:
+                final = False
+                while not final:
+                    # Take every chunk that is ready (up to FILE_SEND_BATCH) and write them in
+                    # one go: one sendmsg for several frames instead of one per chunk
+                    batch = [q.get()]
+                    while len(batch) < FILE_SEND_BATCH:
+                        try:
+                            batch.append(q.get_nowait())
+                        except Empty:
+                            break
+                    frames = []
+                    for item in batch:
+                        if isinstance(item, Exception):
+                            raise item
+                        frame, final = item
+                        frames.append(frame)
+                        if final:
+                            break
+                    self._send_batch(frames, defer=not final)
+            except Exception as e:
+                error = e
+            finally:
+                stop.set()
+                # Free the queue's slots so a reader blocked in put() can finish
+                while True:
+                    try:
+                        q.get_nowait()
+                    except Empty:
+                        break
+                self.end_burst()
+            if on_done:
+                on_done(error)
+
+        threading.Thread(target=produce, name=f"file-read-{file_id}", daemon=True).start()
+        writer = threading.Thread(target=consume, name=f"file-send-{file_id}", daemon=True)
+        writer.start()
+        return writer
 
     def send_file_ack(self, to_user: str, file_id: str, accept: bool):
         ''' 
@@ -173,23 +718,46 @@ class NetClient:
             - accept: boolean indicating if the file offer is accepted
         '''
         body = {"id": file_id, "accept": accept}
-        env = {"type":"file_ack","sender":self.username,"to":to_user,"ts":self.iso_now(),
-               "payload": encrypt_body(self.session_key, body)}
-        send_json(self.sock, env)
+        if accept:
+            body["binary"] = True   # we can take file_chunk_bin frames
+        self._wait_handshake()
+        env = self._envelope("file_ack", to_user, encrypt_body(self.session_cipher, body))
+        self._send(env)
 
-    def _recv_loop(self):
-        ''' Thread function to receive messages from server '''
-        try:
-            while self.running:
-                env = recv_json(self.sock)
-                if self._on_message:  # if the UI handler attached, immediately pass the received message to that callback so that UI ready to display.
-                    self._on_message(env)     
-                else:
-                    # No handler yet (UI not attached) → backlog to replay later
-                    self._backlog.append(env)  # if the UI is not ready, store message in backlog
-        except Exception:
-            # Socket closed or error; notify UI
-            self.running = False
-            if self._on_message:
-                self._on_message({"type":"system","sender":None,"to":"*","ts":self.iso_now(),
-                                  "payload":{"text":"Disconnected."}})
+    def _dispatch(self, env: Dict[str, Any]):
+        ''' Deliver one received message (called on the selector loop thread) '''
+        with self._backlog_lock:
+            cb = self._on_message
+            if cb is None:
+                # No handler yet (UI not attached) → backlog to replay later; when full, the
+                # oldest entry falls out (bounded memory if the UI never attaches)
+                if len(self._backlog) == BACKLOG_MAX:
+                    self._backlog_dropped += 1
+                self._backlog.append(env)  # if the UI is not ready, store message in backlog
+                return
+            self._start_dispatch()
+        # The UI handler is attached: hand the message to the dispatch thread, so decryption and
+        # the handler's work never hold up the selector loop (shared by every connection)
+        self._inbox.put((cb, env))
+
+    def _start_dispatch(self):
+        ''' Start the dispatch thread if it is not running yet (caller holds _backlog_lock) '''
+        if self._dispatch_thread is None:
+            self._dispatch_thread = threading.Thread(target=self._dispatch_loop, name="net-dispatch", daemon=True)
+            self._dispatch_thread.start()
+
+    def _dispatch_loop(self):
+        ''' Dispatch thread: call on_message for each received message, in arrival order '''
+        while True:
+            cb, env = self._inbox.get()
+            try:
+                cb(env)
+            except Exception as e:
+                print(f"[NetClient] on_message handler failed: {e}")
+
+    def _on_disconnect(self):
+        ''' Socket closed or error; notify UI '''
+        self.running = False
+        # Through _dispatch, so the notice is backlogged too if no UI is attached yet
+        self._dispatch({"type":"system","sender":None,"to":"*","ts":self.iso_now(),
+                        "payload":{"text":"Disconnected."}})
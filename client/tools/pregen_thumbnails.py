@@ -0,0 +1,49 @@
+"""
+Pre-generate the login-grid avatar thumbnails shipped in client/img/avatar/thumb/.
+
+Writes one pre-sized WebP per avatar plus a sprite sheet with all of them stacked
+vertically. The login window prefers these over decoding and downscaling the full-size
+originals on first launch. Re-run after adding or editing an avatar:
+
+    python -m client.tools.pregen_thumbnails
+"""
+import argparse
+import os
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+from ..login import AVATAR_SIZE, PREGEN_THUMB_DIR, pregen_thumb_path, avatar_sheet_path, _discover_avatar_files
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pre-generate avatar thumbnails")
+    ap.add_argument("--dir", default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "img", "avatar"),
+                    help="Avatar directory")
+    ap.add_argument("--size", type=int, default=AVATAR_SIZE, help="Thumbnail side length (px)")
+    args = ap.parse_args()
+
+    img_dir = os.path.abspath(args.dir)
+    os.makedirs(os.path.join(img_dir, PREGEN_THUMB_DIR), exist_ok=True)
+    # Same order as the login grid, so sheet cell i is avatar id i
+    files = _discover_avatar_files(img_dir, os.stat(img_dir).st_mtime_ns)
+    size = args.size
+    sheet = Image.new("RGBA", (size, size * len(files)), (0, 0, 0, 0))
+    for i, src in enumerate(files):
+        dst = pregen_thumb_path(src, size)
+        with Image.open(src) as img:
+            # Offline step, so the slower but sharper LANCZOS filter is affordable here
+            img.thumbnail((size, size), Image.Resampling.LANCZOS)
+            img.save(dst, "WEBP", quality=85, method=6)
+            # Centre non-square avatars in their cell
+            tile = img.convert("RGBA")
+            sheet.paste(tile, ((size - tile.width) // 2, i * size + (size - tile.height) // 2))
+        print(f"{os.path.basename(src)} -> {os.path.relpath(dst, img_dir)}")
+
+    meta = PngInfo()
+    meta.add_text("avatars", "\n".join(os.path.basename(f) for f in files))
+    sheet_path = avatar_sheet_path(img_dir, size)
+    sheet.save(sheet_path, "PNG", optimize=True, pnginfo=meta)
+    print(f"sheet -> {os.path.relpath(sheet_path, img_dir)}")
+
+
+if __name__ == "__main__":
+    main()
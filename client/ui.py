@@ -1,17 +1,277 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import datetime, os, uuid
+import datetime, os, re, shutil, sys, tempfile, threading, time, unicodedata, uuid, weakref
 import emoji
+from collections import deque
+from functools import lru_cache
 from typing import Dict, Any, Optional
-from PIL import Image, ImageTk
+from PIL import Image, ImageChops, ImageDraw, ImageOps, ImageTk
+
+from common.crypto import decrypt_body, decrypt_bin, b64d
+from .login import AVATAR_DIR as _AVATAR_DIR, thumb_cache_path, save_thumbnail, _discover_avatar_files
+from .net import file_offer_meta, FILE_CHUNK_HEADER
+
+# File data per file_chunk message: large enough that the per-message cost (envelope, AES-GCM,
+# Base64, one write) is spread over many bytes; a 256 KiB chunk is a ~470 KB frame, far below
+# MAX_FRAME. Receivers take any chunk size, so CHAT_CHUNK (bytes) can tune it per sender, e.g.
+# smaller on a lossy link; it is clamped to 4 KiB..4 MiB so a frame always fits MAX_FRAME
+def _chunk_size(default: int = 256 * 1024) -> int:
+    try:
+        n = int(os.environ.get("CHAT_CHUNK", default))
+    except ValueError:
+        print(f"Ignoring invalid CHAT_CHUNK={os.environ['CHAT_CHUNK']!r}")
+        n = default
+    return min(max(n, 4 * 1024), 4 * 1024 * 1024)
+
+CHUNK = _chunk_size()
+# Mouse wheel events of this platform (X11 reports the wheel as buttons 4/5)
+_WHEEL_EVENTS = ("<Button-4>", "<Button-5>") if sys.platform.startswith("linux") else ("<MouseWheel>",)
+
+# Image folders, resolved once at import (the avatar folder comes from login, see AVATAR_DIR)
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_IMG_DIR = os.path.join(_BASE_DIR, "img")
+# Slash commands typed in the entry: /<cmd> <target> [rest]
+_CMD_RE = re.compile(r'^/(?P<cmd>w)\s+(?P<target>\S+)(?:\s+(?P<rest>.*))?$', re.DOTALL)
+USERLIST_DEBOUNCE_MS = 50   # userlist messages closer together than this are drawn once
+# Filter for the final avatar resize; at 40px BILINEAR after a reduce() pre-pass looks the same
+# as LANCZOS for a fraction of the work (set to Image.Resampling.LANCZOS for the old output)
+AVATAR_RESAMPLING = Image.Resampling.BILINEAR
+
+try:
+    # optional SIMD (SSE4.1/AVX2) Lanczos3 resizer, several times faster than Pillow's
+    from cykooz.resizer import Resizer, ResizeAlg, FilterType
+    _RESIZER = Resizer(ResizeAlg.convolution(FilterType.lanczos3))
+except Exception:   # not installed, or an incompatible release
+    _RESIZER = None
+
+def _resize_lanczos(img: "Image.Image", size: tuple) -> "Image.Image":
+    ''' img resized to size with Lanczos3: cykooz.resizer when available, else Pillow '''
+    if _RESIZER is not None and img.mode in ("RGB", "RGBA", "L", "LA"):
+        try:
+            dst = Image.new(img.mode, size)
+            _RESIZER.resize_pil(img, dst)
+            return dst
+        except Exception:
+            pass
+    return img.resize(size, Image.Resampling.LANCZOS)
+
+
+# :alias: tokens, with the same name characters emojize() accepts
+try:
+    from emoji.core import _EMOJI_NAME_PATTERN
+    from emoji.unicode_codes import get_emoji_by_name, load_from_json
+    load_from_json("alias")
+    _ALIAS_RE = re.compile(":[%s]+:" % _EMOJI_NAME_PATTERN)
+except Exception:   # other emoji releases: plain emojize()
+    _ALIAS_RE = None
+
+@lru_cache(maxsize=512)
+def _alias_emoji(token: str) -> str:
+    ''' Emoji for one ':name:' token (the token itself if it is not a known name or alias) '''
+    return get_emoji_by_name(":" + unicodedata.normalize("NFKC", token[1:-1]) + ":", "alias") or token
+
+@lru_cache(maxsize=1024)
+def _emojize_alias(text: str) -> str:
+    ''' Whole-message emojize() for emoji releases without the name pattern; repeated phrases hit the cache '''
+    return emoji.emojize(text, language="alias")
+
+def _alias_match(m: "re.Match") -> str:
+    ''' re.sub callback of fast_emojize (one module-level function, not a lambda per message) '''
+    return _alias_emoji(m.group(0))
+
+def fast_emojize(text: str) -> str:
+    '''
+    emoji.emojize(text, language="alias") for outgoing messages. Most messages contain no
+    alias at all, so they are returned as is without a regex pass; tokens that do occur are
+    looked up once and remembered.
+    '''
+    if ":" not in text:
+        return text
+    if _ALIAS_RE is None:
+        return _emojize_alias(text)
+    return _ALIAS_RE.sub(_alias_match, text)
+
+# List of popular emoji codes (alias format) offered by the emoji picker
+_EMOJI_CODES = [
+    ":grinning:", ":smiley:", ":smile:", ":grin:", ":sweat_smile:", ":joy:", ":rofl:",
+    ":relaxed:", ":blush:", ":slightly_smiling_face:", ":upside_down_face:", ":wink:", ":relieved:", ":heart_eyes:", ":kissing_heart:",
+    ":kissing:", ":kissing_smiling_eyes:", ":kissing_closed_eyes:", ":yum:", ":stuck_out_tongue:", ":stuck_out_tongue_winking_eye:",
+    ":stuck_out_tongue_closed_eyes:", ":money_mouth_face:", ":hugs:", ":nerd_face:", ":sunglasses:", ":star_struck:",
+    ":thinking:", ":zipper_mouth_face:", ":neutral_face:", ":expressionless:", ":no_mouth:", ":smirk:", ":unamused:",
+    ":roll_eyes:", ":grimacing:", ":lying_face:", ":pensive:", ":sleepy:", ":sleeping:", ":sweat:",
+    ":cry:", ":sob:", ":disappointed_relieved:", ":cold_sweat:", ":fearful:", ":scream:", ":confounded:", ":persevere:",
+    ":triumph:", ":angry:", ":rage:", ":clap:", ":raised_hands:", ":wave:", ":thumbs_up:", ":thumbs_down:", ":ok_hand:",
+    ":pray:", ":muscle:", ":heart:", ":orange_heart:", ":yellow_heart:", ":green_heart:", ":blue_heart:", ":purple_heart:",
+    ":black_heart:", ":white_heart:", ":sparkles:", ":fire:", ":star:", ":zap:", ":tada:", ":confetti_ball:", ":rocket:",
+]
+
+def _build_emoji_items():
+    ''' (symbol, code) for every code in _EMOJI_CODES that the emoji package knows '''
+    items = []
+    for c in _EMOJI_CODES:
+        try:
+            # Convert emoji code to symbol
+            items.append((emoji.emojize(c, language="alias"), c))
+        except Exception:
+            # Skip emoji if emojize fails
+            pass
+    return tuple(items)
+
+# Constant for the process, so emojized once here instead of on every picker open
+_EMOJI_ITEMS = _build_emoji_items()
+# Search key of each item, same order: code without the colons, _ as space
+_EMOJI_KEYS = tuple(code.strip(":").replace("_", " ") for _, code in _EMOJI_ITEMS)
+
+# Circular 'L' masks by size; they depend only on the size, so each one is drawn once
+_MASK_CACHE: Dict[int, Any] = {}
+_MASK_SUPERSAMPLE = 4   # circle masks are drawn this many times larger, then reduced
+
+def _circle_mask(size: int):
+    ''' Return the (shared, do not modify) circular mask for a size x size avatar '''
+    mask = _MASK_CACHE.get(size)
+    if mask is None:
+        # Drawn at 4x and box-reduced, which gives the circle a smooth (antialiased) edge;
+        # built once per size, so the larger canvas costs nothing later
+        big = size * _MASK_SUPERSAMPLE
+        mask = Image.new('L', (big, big), 0)
+        ImageDraw.Draw(mask).ellipse((0, 0, big - 1, big - 1), fill=255)
+        mask = _MASK_CACHE[size] = mask.reduce(_MASK_SUPERSAMPLE)
+    return mask
+
+@lru_cache(maxsize=64)
+def _circle_image(path: str, size: int, mtime_ns: int):
+    '''
+    Return the avatar at path resized to size x size with a circular alpha mask (PIL RGBA image).
+    Results are cached in memory (keyed by path, size and mtime_ns) and on disk as
+    circle2_<sha1>.rgba next to the login thumbnails, so the mask is only computed once per file.
+    The disk copy is raw RGBA pixels: loading it is one read, with no PNG (zlib) decode.
+    '''
+    # circle2_: rendered with the antialiased mask (circle_ files hold the older, jagged one)
+    cache_path = os.path.splitext(thumb_cache_path(path, size, prefix="circle2_"))[0] + ".rgba"
+    try:
+        with open(cache_path, "rb") as f:
+            data = f.read()
+        if len(data) == size * size * 4:
+            return Image.frombuffer("RGBA", (size, size), data, "raw", "RGBA", 0, 1)
+    except OSError:
+        pass
+    with Image.open(path) as src:   # close the full-size source as soon as it is resized
+        # JPEG only (no-op otherwise): let libjpeg decode at 1/2..1/8 scale, kept >= 2x the target
+        # so the resize filter still has enough pixels to work with
+        src.draft("RGB", (size * 2, size * 2))
+        # Cheap integer box downsample in C to about 2x the target, then one small filtered resize
+        factor = max(1, min(src.size) // (size * 2))
+        img = src.reduce(factor) if factor > 1 else src
+        # fit() centre-crops to a square and resizes in one call (non-square avatars are no longer squashed)
+        img = ImageOps.fit(img, (size, size), method=AVATAR_RESAMPLING)
+
+    mask = _circle_mask(size)
+    if img.mode == "RGBA":
+        # Multiply into the existing alpha so transparent parts of the source stay transparent
+        mask = ImageChops.multiply(img.getchannel("A"), mask)
+    img.putalpha(mask)   # in place on the resized image, no extra RGBA canvas
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")   # e.g. LA from a greyscale source; the raw cache is RGBA
+    save_thumbnail(img, cache_path, raw=True)
+    return img
+
+# Circular avatar PhotoImages by (path, mtime_ns, size): userlist refreshes reuse them instead
+# of converting the PIL image again; an edited avatar file gets a new key. Values are weak: the
+# Labels showing an avatar (label.image) keep it alive, so images nobody shows any more are freed
+_AVATAR_PHOTOS: "weakref.WeakValueDictionary[tuple, Any]" = weakref.WeakValueDictionary()
+# path -> (checked_at, mtime_ns): a userlist refresh stats each avatar file at most once per
+# AVATAR_STAT_TTL seconds instead of once per user row
+_AVATAR_MTIMES: Dict[str, tuple] = {}
+AVATAR_STAT_TTL = 5.0
+
+def _avatar_mtime(path: str) -> int:
+    ''' mtime_ns of an avatar file, re-checked at most every AVATAR_STAT_TTL seconds (raises OSError if gone) '''
+    now = time.monotonic()
+    hit = _AVATAR_MTIMES.get(path)
+    if hit is not None and now - hit[0] < AVATAR_STAT_TTL:
+        return hit[1]
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        _AVATAR_MTIMES.pop(path, None)
+        raise
+    _AVATAR_MTIMES[path] = (now, mtime_ns)
+    return mtime_ns
+
+def _prewarm_avatars(paths, size: int):
+    '''
+    Build the circular avatar images for paths ahead of time (worker thread: Pillow only, no Tk),
+    so the first userlist only wraps cached images in PhotoImages instead of decoding files
+    '''
+    for path in paths:
+        try:
+            _circle_image(path, size, _avatar_mtime(path))
+        except Exception as e:
+            print(f"Cannot prepare avatar {path}: {e}")
 
-from common.crypto import decrypt_body
+# Button icons by (file name in client/img, size); a new ChatUI reuses the decoded PhotoImages
+_ICON_CACHE: Dict[tuple, Any] = {}
 
-CHUNK = 32 * 1024 
+def _icon_photo(name: str, size: tuple):
+    ''' PhotoImage of client/img/<name> resized to size, or None if it cannot be loaded '''
+    key = (name, size)
+    if key not in _ICON_CACHE:
+        try:
+            img = Image.open(os.path.join(_IMG_DIR, name))
+            img.draft("RGB", (size[0] * 2, size[1] * 2))   # JPEG: decode at reduced scale
+            img = _resize_lanczos(img, size)
+            _ICON_CACHE[key] = ImageTk.PhotoImage(img)
+        except Exception:
+            return None   # not cached: a file added later is picked up
+    return _ICON_CACHE[key]
+
+# Fallback circular colored avatars (RGBA), used when no avatar file can be loaded
+_FALLBACK_COLORS = [(255, 182, 193, 255), (173, 216, 230, 255)]
+_FALLBACK_PHOTOS: Dict[tuple, Any] = {}   # (color index, size) -> PhotoImage
+
+def _fallback_avatar(avatar_id: int, size: int):
+    ''' PhotoImage of the fallback avatar for avatar_id; rendered once per colour and size '''
+    key = (avatar_id % len(_FALLBACK_COLORS), size)
+    photo = _FALLBACK_PHOTOS.get(key)
+    if photo is None:
+        # A flat colour cut with the same cached mask as real avatars (identical outline)
+        img = Image.new("RGBA", (size, size), _FALLBACK_COLORS[key[0]])
+        img.putalpha(_circle_mask(size))
+        photo = _FALLBACK_PHOTOS[key] = ImageTk.PhotoImage(img)
+    return photo
+
+@lru_cache(maxsize=4096)
+def _fmt_ts(ts: str) -> str:
+    ''' HH:MM:SS in local time for an ISO timestamp (memoized: messages of the same second share it) '''
+    try:
+        s = ts
+        # Support ISO strings with trailing 'Z' (UTC)
+        if s.endswith("Z"):
+            s = s.replace("Z", "+00:00")
+        dt = datetime.datetime.fromisoformat(s)
+        if dt.tzinfo is None:
+            # Treat naive timestamps as UTC
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        local_dt = dt.astimezone()  # convert to local timezone
+        return local_dt.strftime("%H:%M:%S")
+    except Exception:
+        # Fallback to substring if parsing fails
+        try:
+            return ts[11:19]
+        except Exception:
+            return "--:--:--"
 
-class ChatUI(tk.Tk):
-    def __init__(self, username: str, net, avatar_id: int = 0):
-        super().__init__() 
+class ChatUI(tk.Toplevel):
+    # append() tag -> Text tags (unknown tags: unstyled)
+    _TAG_MAP = {"system": ("system",), "private": ("private",), "public": ("public",), None: ()}
+    # Encrypted kinds the server delivers to one user; "to" names that user
+    _DIRECTED_TYPES = frozenset(("priv", "file_offer", "file_ack", "file_chunk", "file_chunk_bin"))
+    # Encrypted kinds whose body is bytes rather than JSON
+    _RAW_BODY_TYPES = frozenset(("file_chunk_bin",))
+    _SIZE_UNITS = ("B", "KB", "MB", "GB")   # _format_size units, 1024x apart
+
+    def __init__(self, master: tk.Tk, username: str, net, avatar_id: int = 0):
+        super().__init__(master)   # window on the application's shared Tk root
         # Set core state
         self.username = username
         self.avatar_id = avatar_id  # Current user's avatar ID
@@ -29,9 +289,13 @@ class ChatUI(tk.Tk):
             except Exception:
                 pass
         
-        # Dictionary to store avatar images to prevent garbage collection
-        self.avatar_images = {}
         self.user_avatars = {}  # username -> avatar_id mapping
+        self._user_rows: Dict[str, Dict[str, Any]] = {}  # username -> {"widget", "avatar_id"} (Active list rows)
+        self._highlighted_user: Optional[str] = None     # user whose row is painted as selected
+        self._ts_cache = (None, "")   # (epoch second, ts() text) of the last ts() call
+        self._pending_userlist = None   # latest userlist not drawn yet
+        self._userlist_job = False      # a _flush_userlist is scheduled (under _jobs_lock)
+        self._jobs_lock = threading.Lock()   # guards the *_job flags: handlers set them off the Tk thread
 
         # right pane / user list
         self.columnconfigure(0, weight=1)
@@ -53,6 +317,18 @@ class ChatUI(tk.Tk):
         sb = ttk.Scrollbar(frame, orient="vertical", command=self.text.yview)
         sb.grid(row=0, column=1, sticky="ns")
         self.text.configure(yscrollcommand=sb.set)
+        # Tag styles are configured once here, not on every message
+        self.text.tag_config("system", foreground="gray")
+        self.text.tag_config("private", foreground="#d06b00")
+        self.text.tag_config("public", foreground="#2a64cb")
+        self.text.tag_config("file_msg", foreground="#FF6B35", font=("Segoe UI", 10, "bold"))
+        self.text.tag_config("file_name", underline=True, font=("Segoe UI Emoji", 11, "bold"), foreground="#2a64cb")
+        # File name links: bound once on the shared tag; the clicked file is found from its file_<id> tag
+        self.text.tag_bind("file_name", "<Button-1>", self._on_file_link_click)
+        self.text.tag_bind("file_name", "<Enter>", lambda e: self.text.config(cursor="hand2"))
+        self.text.tag_bind("file_name", "<Leave>", lambda e: self.text.config(cursor=""))
+        self._pending_appends = deque()   # Text.insert segments waiting for _flush_appends
+        self._append_job = False          # a _flush_appends is scheduled (under _jobs_lock)
 
         # user list - replaced Listbox with Canvas to draw avatar + name
         right = ttk.Frame(self)   # right pane for user list
@@ -78,14 +354,24 @@ class ChatUI(tk.Tk):
         # Align the user list content to the left edge of the canvas
         self.canvas_window = self.user_canvas.create_window((0, 0), window=self.user_frame, anchor="nw")
         
-        # Bind to update scroll region and center window
+        # Bind to update scroll region. The window item stays pinned at (0, 0) (no centering), so
+        # the scroll region is just the user_frame's size: no bbox("all") walk and no item move
+        # on every <Configure>, and nothing at all when the size did not actually change
+        self._user_scroll_size = None
         def update_canvas(e):
-            # Keep scroll region updated and keep the content pinned to the left (no centering)
-            self.user_canvas.configure(scrollregion=self.user_canvas.bbox("all"))
-            self.user_canvas.coords(self.canvas_window, 0, 0)
+            size = (e.width, e.height)
+            if size != self._user_scroll_size:
+                self._user_scroll_size = size
+                self.user_canvas.configure(scrollregion=(0, 0, e.width, e.height))
         
         self.user_frame.bind("<Configure>", update_canvas)  # when user_frame size changes, update canvas to have the correct scrollregion
-        self.user_canvas.bind("<Configure>", update_canvas) # when canvas size changes, update as well
+        # Background click (empty space) clears the selection; bound once here, as rebinding
+        # on every userlist would register a new Tcl command each time
+        self.user_frame.bind("<Button-1>", lambda e: self._clear_selection())
+        # Row clicks are bound once for all rows through a bind tag every row carries, instead of
+        # once per row; the tag is per window since class bindings are global to the Tk root
+        self._user_row_tag = f"UserRow{self}"
+        self.bind_class(self._user_row_tag, "<Button-1>", self._on_user_click)
 
         # Enable two-finger trackpad scrolling (mouse wheel) for the Active user list
         # Windows/macOS generate <MouseWheel> with event.delta; Linux uses <Button-4>/<Button-5>
@@ -105,28 +391,17 @@ class ChatUI(tk.Tk):
 
         def _ul_bind_mousewheel(_e=None):
             ''' Enable mouse wheel scrolling for user list '''
-            import sys
-            if sys.platform.startswith('linux'):
-                self.user_canvas.bind_all('<Button-4>', _ul_on_mousewheel)
-                self.user_canvas.bind_all('<Button-5>', _ul_on_mousewheel)
-            else:
-                self.user_canvas.bind_all('<MouseWheel>', _ul_on_mousewheel)
+            for seq in _WHEEL_EVENTS:
+                self.user_canvas.bind_all(seq, _ul_on_mousewheel)
 
         def _ul_unbind_mousewheel(_e=None):
             ''' Disable mouse wheel scrolling for user list '''
-            import sys
-            if sys.platform.startswith('linux'):
-                self.user_canvas.unbind_all('<Button-4>')
-                self.user_canvas.unbind_all('<Button-5>')
-            else:
-                self.user_canvas.unbind_all('<MouseWheel>')
+            for seq in _WHEEL_EVENTS:
+                self.user_canvas.unbind_all(seq)
 
         self.user_canvas.bind('<Enter>', _ul_bind_mousewheel)  # bind when mouse enters user list
         self.user_canvas.bind('<Leave>', _ul_unbind_mousewheel) # unbind when mouse leaves user list
         
-        # Store reference for selection
-        self.users = tk.Listbox(right)  # Keep for backward compatibility with old code
-        self.users.pack_forget()  # Hide, not used anymore
         self.selected_user = None  # Track selected user
 
         # Allow clearing selection with Escape key
@@ -214,37 +489,35 @@ class ChatUI(tk.Tk):
         except Exception:
             pass
 
-        self.current_downloads: Dict[str, dict] = {}  # file_id -> {"name":..., "chunks":{}}
+        self.current_downloads: Dict[str, dict] = {}  # file_id -> download context, see _new_download
+        self._failed_downloads: set = set()   # file_ids of downloads given up after a write error
         self.current_upload: Optional[dict] = None    # {"path": str}
+        self.available_files: Dict[str, dict] = {}    # file_id -> offer info, until downloaded or declined
+
+        # Avatar ids map onto a small fixed set of files: decode them all in the background now
+        try:
+            avatar_files = _discover_avatar_files(_AVATAR_DIR, os.stat(_AVATAR_DIR).st_mtime_ns)
+        except Exception:
+            avatar_files = ()
+        threading.Thread(target=_prewarm_avatars, args=(avatar_files, 40), name="avatar-prewarm", daemon=True).start()
 
         # NOW attach the message handler - this will flush any backlogged messages
         # All widgets are created, so callbacks can safely update the UI
+        # Message type -> handler: plaintext types get the envelope, encrypted types the decrypted body too
+        self._handlers = {"system": self._h_system, "userlist": self._h_userlist}
+        self._encrypted_handlers = {"pub": self._h_pub, "priv": self._h_priv, "file_offer": self._h_file_offer,
+                                    "file_ack": self._h_file_ack, "file_chunk": self._h_file_chunk,
+                                    "file_chunk_bin": self._h_file_chunk_bin}
         self.net.on_message = self._on_message  # It runs every time a message is received from the network. It's responsible for processing incoming data (like chats, user lists, and file offers) and updating the UI.
 
     def _load_button_icons(self):
         """
         Load icons emoji_button.png, file_button.png and download_button.png from client/img folder
         """
-        # Helper to load an image safely
-        def _safe_load(path: str, size: tuple[int, int]):
-            try:
-                img = Image.open(path)
-                img = img.resize(size, Image.Resampling.LANCZOS)
-                return ImageTk.PhotoImage(img)
-            except Exception:
-                return None
-
-        # Paths
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        img_dir = os.path.join(current_dir, "img")
-        emoji_path = os.path.join(img_dir, "emoji_button.png")
-        file_path = os.path.join(img_dir, "file_button.png")
-        download_path = os.path.join(img_dir, "download_button.png")
-
         # Attempt to load each icon independently
-        emoji_icon = _safe_load(emoji_path, (28, 28))
-        file_icon = _safe_load(file_path, (28, 28))
-        download_icon = _safe_load(download_path, (24, 24))
+        emoji_icon = _icon_photo("emoji_button.png", (28, 28))
+        file_icon = _icon_photo("file_button.png", (28, 28))
+        download_icon = _icon_photo("download_button.png", (24, 24))
 
         # Fallback gray icon
         fallback28 = ImageTk.PhotoImage(Image.new('RGBA', (28, 28), (200, 200, 200, 255)))
@@ -263,95 +536,93 @@ class ChatUI(tk.Tk):
         """Load an avatar image by index from client/img/avatar and mask to a circle.
 
         - Scans the avatar folder once and caches the file list in self._avatar_files.
-        - Supports .png/.jpg/.jpeg files; sorts numerically by number in filename if present.
+        - Supports .png/.jpg/.jpeg files; sorted like the login grid (numerically by number in filename if present).
         - Falls back to a simple colored circle if no files exist or loading fails.
+        - PhotoImages are shared through _AVATAR_PHOTOS, keyed by (path, mtime_ns, size).
         """
-        # Cache by (id,size) to avoid reprocessing
-        cache_key = f"{avatar_id}_{size}"
-        if cache_key in self.avatar_images:
-            return self.avatar_images[cache_key]
-
-        # Build avatar file list once
-        if not hasattr(self, "_avatar_files"):
-            img_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "img", "avatar")
-            files = []
+        # Build avatar file list once (again only if one of its files disappeared)
+        if getattr(self, "_avatar_files", None) is None:
             try:
-                for name in os.listdir(img_root):
-                    lower = name.lower()
-                    if lower.endswith((".png", ".jpg", ".jpeg")):
-                        files.append(os.path.join(img_root, name))
+                # Same scan (and order) as the login window, so avatar ids match
+                files = list(_discover_avatar_files(_AVATAR_DIR, os.stat(_AVATAR_DIR).st_mtime_ns))
             except Exception:
                 files = []
-            import re
-            def sort_key(path: str):
-                base = os.path.basename(path).lower()
-                m = re.search(r"avatar\s*(\d+)", base)
-                return (0, int(m.group(1))) if m else (1, base)
-            files.sort(key=sort_key)
             self._avatar_files = files
 
         try:
             if self._avatar_files:
                 # Map id to available files, wrap around if out of range
                 path = self._avatar_files[avatar_id % len(self._avatar_files)]
-                img = Image.open(path)
-                img = img.resize((size, size), Image.Resampling.LANCZOS)
+                try:
+                    key = (path, _avatar_mtime(path), size)
+                except FileNotFoundError:
+                    self._avatar_files = None   # folder changed: rescan on the next call
+                    raise
             else:
                 raise FileNotFoundError("No avatar images found")
 
-            # Create circular mask
-            mask = Image.new('L', (size, size), 0)
-            from PIL import ImageDraw
-            draw = ImageDraw.Draw(mask)
-            draw.ellipse((0, 0, size, size), fill=255)
-            img.putalpha(mask)
-
-            photo = ImageTk.PhotoImage(img)
-            self.avatar_images[cache_key] = photo
+            photo = _AVATAR_PHOTOS.get(key)
+            if photo is None:
+                photo = ImageTk.PhotoImage(_circle_image(path, size, key[1]))
+                # Drop the entry for an older version of the same file
+                for old in [k for k in list(_AVATAR_PHOTOS.keys()) if k[0] == path and k[2] == size]:
+                    _AVATAR_PHOTOS.pop(old, None)
+                _AVATAR_PHOTOS[key] = photo
             return photo
         except Exception as e:
-            # Fallback circular colored avatar
-            colors = [(255, 182, 193, 255), (173, 216, 230, 255)]  # RGBA
-            clr = colors[avatar_id % len(colors)]
-            img = Image.new("RGBA", (size, size), clr)
-            mask = Image.new('L', (size, size), 0)
-            from PIL import ImageDraw
-            draw = ImageDraw.Draw(mask)
-            draw.ellipse((0, 0, size, size), fill=255)
-            img.putalpha(mask)
-            photo = ImageTk.PhotoImage(img)
-            self.avatar_images[cache_key] = photo
-            return photo
+            return _fallback_avatar(avatar_id, size)
 
     def append(self, text: str, tag: Optional[str] = None):
-        ''' Append a text message to the chat area with optional tag for styling.'''
+        '''
+        Append a text message to the chat area with optional tag for styling.
+        Lines are queued and written by _flush_appends when Tk is idle, so a burst of messages
+        costs one insert, one redraw and one scroll. Safe to call from any thread.
+        '''
+        tags = self._TAG_MAP.get(tag, ())
+        self._queue_segments((text, tags, "\n", tags))
+
+    def _queue_segments(self, segments: tuple):
+        ''' Queue Text.insert segments (chars, tags, chars, tags, ...) for the next _flush_appends '''
+        self._pending_appends.append(segments)
+        with self._jobs_lock:
+            if self._append_job:
+                return
+            self._append_job = True
+        self.after_idle(self._flush_appends)   # outside the lock: from another thread this waits for Tk
+
+    def _at_bottom(self) -> bool:
+        ''' True if the chat view shows its end (then new lines keep it scrolled to the bottom) '''
+        # Users who scrolled up to read history keep their place, and no scroll is done for them
+        return self.text.yview()[1] > 0.98
+
+    def _flush_appends(self):
+        ''' Write all queued append() lines with a single Text.insert (newline as its own segment, no text + "\n" copy) '''
+        # Clear the flag first: a line queued while we write schedules a new flush
+        with self._jobs_lock:
+            self._append_job = False
+        args = []
+        while True:
+            try:
+                args += self._pending_appends.popleft()   # deque: safe against appends from other threads
+            except IndexError:
+                break
+        if not args:
+            return
+        stick = self._at_bottom()
         self.text.configure(state="normal")
-        if tag == "system":
-            self.text.insert("end", text + "\n", ("system",))
-        elif tag == "private":
-            self.text.insert("end", text + "\n", ("private",)) 
-        elif tag == "public":
-            self.text.insert("end", text + "\n", ("public",))
-        else:
-            self.text.insert("end", text + "\n")
-        self.text.tag_config("system", foreground="gray")
-        self.text.tag_config("private", foreground="#d06b00")
-        self.text.tag_config("public", foreground="#2a64cb")
+        self.text.insert("end", *args)   # insert accepts "chars tags chars tags ..."
         self.text.configure(state="disabled")
-        self.text.see("end")
+        if stick:
+            # One scroll per flush: every line queued since the last idle cycle shares it
+            self.text.see("end")
 
     def _append_file_message_sent(self, filename: str, size: int):
         """
         Display file send notification on sender side,
         with content format matching receiver side.
         """
-        self.text.configure(state="normal")
-        msg = f" {self.username} send file: {filename} ({self._format_size(size)}) \n"
-        self.text.insert("end", msg, ("file_msg",))
-        # Synchronize style with message on receiver side
-        self.text.tag_config("file_msg", foreground="#FF6B35", font=("Segoe UI", 10, "bold"))
-        self.text.configure(state="disabled")
-        self.text.see("end")
+        # Queued with the other lines, so it shares their single insert (and stays in order)
+        self._queue_segments((f" {self.username} send file: {filename} ({self._format_size(size)}) \n", ("file_msg",)))
 
     def _format_size(self, size_bytes: int) -> str:
         """
@@ -363,14 +634,11 @@ class ChatUI(tk.Tk):
         Returns:
             Formatted string (e.g., "1.5 MB")
         """
-        if size_bytes < 1024:
+        # Unit from the bit length (each unit is 10 more bits), capped at GB
+        idx = min(max(0, (int(size_bytes).bit_length() - 1) // 10), 3)
+        if idx == 0:
             return f"{size_bytes} B"
-        elif size_bytes < 1024 * 1024:
-            return f"{size_bytes / 1024:.1f} KB"
-        elif size_bytes < 1024 * 1024 * 1024:
-            return f"{size_bytes / (1024 * 1024):.1f} MB"
-        else:
-            return f"{size_bytes / (1024 * 1024 * 1024):.1f} GB"
+        return f"{size_bytes / (1 << (idx * 10)):.1f} {self._SIZE_UNITS[idx]}"
     
     def _download_file(self, file_id: str):
         """
@@ -379,22 +647,18 @@ class ChatUI(tk.Tk):
         Args:
             file_id: ID of file to download
         """
-        if not hasattr(self, 'available_files') or file_id not in self.available_files:
+        if file_id not in self.available_files:
             messagebox.showerror("Error", "File does not exist or has expired!")
             return
         
         file_info = self.available_files[file_id]
         
+        # Initialize download context (before the ACK: chunks may arrive right after it)
+        self.current_downloads[file_id] = self._new_download(file_info['name'], file_info.get('size', 0), file_info.get('chunk', 0))
+        
         # Send download request to sender
         self.net.send_file_ack(file_info['sender'], file_id, True)
         
-        # Initialize download context
-        self.current_downloads[file_id] = {
-            "name": file_info['name'],
-            "chunks": {},
-            "next": 0
-        }
-        
         self.append(f"(System) Downloading file '{file_info['name']}' from {file_info['sender']}...", "system")
 
     def _show_file_offer_dialog(self, sender: str, filename: str, size: int, file_type: str, file_id: str):
@@ -426,31 +690,29 @@ class ChatUI(tk.Tk):
         if result:
             # User accepted - send ACK and start download
             self.append(f"(System) ({self.ts()}) Accepting file '{filename}' from {sender}...", "system")
+            # Initialize download context (before the ACK: chunks may arrive right after it)
+            self.current_downloads[file_id] = self._new_download(filename, size, self.available_files.get(file_id, {}).get("chunk", 0))
             self.net.send_file_ack(sender, file_id, True)
-            
-            # Initialize download context
-            self.current_downloads[file_id] = {
-                "name": filename,
-                "chunks": {},
-                "next": 0
-            }
         else:
             # User declined - send rejection ACK
             self.append(f"(System) ({self.ts()}) Declined file '{filename}' from {sender}.", "system")
             self.net.send_file_ack(sender, file_id, False)
             # Remove from available files
-            if hasattr(self, 'available_files') and file_id in self.available_files:
-                del self.available_files[file_id]
+            self.available_files.pop(file_id, None)
 
     def ts(self):
-        return datetime.datetime.now().strftime("%H:%M:%S")
+        ''' Local time as HH:MM:SS; rebuilt at most once per second, since it has seconds resolution '''
+        sec = int(time.time())
+        cached = self._ts_cache
+        if cached[0] != sec:
+            cached = self._ts_cache = (sec, time.strftime("%H:%M:%S", time.localtime(sec)))
+        return cached[1]
 
     def send_text(self):
         # Ignore placeholder content
-        current = self.entry.get()
-        if self._has_placeholder or not current.strip():
+        raw = self.entry.get().strip()
+        if self._has_placeholder or not raw:
             return
-        raw = current.strip()
         self.entry.delete(0, "end")
         # Re-apply placeholder after sending
         try:
@@ -459,19 +721,11 @@ class ChatUI(tk.Tk):
         except Exception:
             pass
 
-        # command: /w <user> message   → private
-        if raw.startswith("/w "):
-            try:
-                rest = raw[3:].strip()
-                target, msg = rest.split(" ", 1)
-                if target == self.username:
-                    self.append("(System) You cannot private-message yourself.", "system")
-                    return
-                msg = emoji.emojize(msg, language="alias")
-                self.net.send_private(target, msg)
-                self.append(f"(Private) (To {target}) ({self.ts()}): {msg}", "private")
-            except ValueError:
-                messagebox.showerror("Format", "Use: /w <username> <message>")
+        # commands: one regex match, then a dispatch table (new commands = one more entry);
+        # plain messages (no leading '/') skip the regex
+        m = _CMD_RE.match(raw) if raw[0] == "/" else None
+        if m:
+            {"w": self._cmd_w}[m["cmd"]](m["target"], m["rest"])
             return
 
         # if a user is selected, send private; otherwise public
@@ -480,21 +734,39 @@ class ChatUI(tk.Tk):
             if target == self.username:
                 self.append("(System) You cannot private-message yourself.", "system")
                 return
-            msg = emoji.emojize(raw, language="alias")
+            msg = fast_emojize(raw)
             self.net.send_private(target, msg)
             self.append(f"(Private) (To {target}) ({self.ts()}): {msg}", "private")
         else:
-            msg = emoji.emojize(raw, language="alias")
+            msg = fast_emojize(raw)
             self.net.send_public(msg)
 
+    def _cmd_w(self, target: str, msg: Optional[str]):
+        ''' /w <user> message   → private '''
+        if not msg:
+            messagebox.showerror("Format", "Use: /w <username> <message>")
+            return
+        if target == self.username:
+            self.append("(System) You cannot private-message yourself.", "system")
+            return
+        msg = fast_emojize(msg)
+        self.net.send_private(target, msg)
+        self.append(f"(Private) (To {target}) ({self.ts()}): {msg}", "private")
+
     # ========== Emoji picker UI ==========
     def open_emoji_picker(self):
         """
         Open emoji picker window with search bar, scrollbar and emoji grid display
         """
-        # Prevent opening multiple emoji picker windows at once
-        if getattr(self, "_emoji_win", None) and tk.Toplevel.winfo_exists(self._emoji_win):
-            self._emoji_win.lift()  # Bring already open window to front
+        # The picker is built once; closing it only hides it, so reopening is just a deiconify
+        win = getattr(self, "_emoji_win", None)
+        if win is not None and win.winfo_exists():
+            self._place_emoji_picker(win)
+            if self._emoji_query.get():
+                self._emoji_query.set("")   # show the full grid again (no re-filter if it already is)
+            win.deiconify()
+            win.lift()  # Bring window to front
+            self._emoji_search.focus_set()
             return
 
         # Create new Toplevel window
@@ -503,23 +775,18 @@ class ChatUI(tk.Tk):
         win.title("Pick an emoji")
         win.transient(self)  # Attach to main window
         win.resizable(False, False)  # Don't allow resize
-        
-        # Position window near mouse cursor (near emoji button)
-        try:
-            x = self.winfo_pointerx()
-            y = self.winfo_pointery()
-            win.geometry(f"360x280+{x-190}+{y-350}")
-        except Exception:
-            win.geometry("360x280")
+        self._place_emoji_picker(win)
 
-        # Close window when Escape key is pressed
-        win.bind("<Escape>", lambda e: win.destroy())
+        def hide(_e=None):
+            try:
+                _unbind_mousewheel(None)   # no <Leave> is guaranteed when the window goes away
+                win.withdraw()
+            except Exception:
+                pass
 
-        # Save cursor position in entry to insert emoji at correct position
-        try:
-            self._emoji_insert_pos = self.entry.index("insert")
-        except Exception:
-            self._emoji_insert_pos = None
+        # Close (hide) window when Escape key is pressed or the window is closed
+        win.bind("<Escape>", hide)
+        win.protocol("WM_DELETE_WINDOW", hide)
 
         # ===== SEARCH BAR =====
         top = ttk.Frame(win)
@@ -528,6 +795,7 @@ class ChatUI(tk.Tk):
         query = tk.StringVar(master=win)
         ent = ttk.Entry(top, textvariable=query)
         ent.pack(side="left", fill="x", expand=True, padx=(6,0))
+        self._emoji_query, self._emoji_search = query, ent
 
         # ===== SCROLLABLE CANVAS FOR GRID =====
         container = ttk.Frame(win)
@@ -538,11 +806,21 @@ class ChatUI(tk.Tk):
         vsb = ttk.Scrollbar(container, orient="vertical", command=canvas.yview)
         frame = ttk.Frame(canvas)
         
-        # Update scroll region when frame size changes
-        frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(scrollregion=canvas.bbox("all"))
-        )
+        # Update scroll region when frame size changes. Filtering re-grids many buttons at once,
+        # so the update is coalesced into one after_idle() call and skipped if the size is unchanged
+        layout = {"job": None, "size": None, "width": None}
+        def _apply_scrollregion():
+            layout["job"] = None
+            size = (frame.winfo_width(), frame.winfo_height())
+            if size != layout["size"]:
+                layout["size"] = size
+                canvas.configure(scrollregion=(0, 0) + size)   # frame sits at (0, 0): its size is the bbox
+
+        def _on_frame_config(_e):
+            if layout["job"] is None:
+                layout["job"] = frame.after_idle(_apply_scrollregion)
+
+        frame.bind("<Configure>", _on_frame_config)
         
         # Embed frame into canvas and keep window id for resize
         window_id = canvas.create_window((0, 0), window=frame, anchor="nw")
@@ -550,8 +828,12 @@ class ChatUI(tk.Tk):
         canvas.pack(side="left", fill="both", expand=True)
         vsb.pack(side="right", fill="y")
 
-        # Synchronize frame width with canvas to avoid horizontal clipping
+        # Synchronize frame width with canvas to avoid horizontal clipping (only on a real change,
+        # since resizing the window item triggers another layout pass)
         def _on_canvas_config(e):
+            if e.width == layout["width"]:
+                return
+            layout["width"] = e.width
             try:
                 canvas.itemconfigure(window_id, width=e.width)
             except Exception:
@@ -577,21 +859,13 @@ class ChatUI(tk.Tk):
 
         def _bind_mousewheel(_e):
             # Bind mouse wheel when cursor enters canvas
-            import sys
-            if sys.platform.startswith('linux'):
-                canvas.bind_all('<Button-4>', _on_mousewheel)
-                canvas.bind_all('<Button-5>', _on_mousewheel)
-            else:
-                canvas.bind_all('<MouseWheel>', _on_mousewheel)
+            for seq in _WHEEL_EVENTS:
+                canvas.bind_all(seq, _on_mousewheel)
 
         def _unbind_mousewheel(_e):
             # Unbind mouse wheel when cursor leaves canvas
-            import sys
-            if sys.platform.startswith('linux'):
-                canvas.unbind_all('<Button-4>')
-                canvas.unbind_all('<Button-5>')
-            else:
-                canvas.unbind_all('<MouseWheel>')
+            for seq in _WHEEL_EVENTS:
+                canvas.unbind_all(seq)
 
         canvas.bind('<Enter>', _bind_mousewheel)
         canvas.bind('<Leave>', _unbind_mousewheel)
@@ -604,60 +878,66 @@ class ChatUI(tk.Tk):
         except Exception:
             style.configure("Emoji.TButton", padding=(4, 2))
         
-        # Get list of all emojis
-        all_items = self._emoji_items()   # get list of (symbol, code) tuples
+        # Create every button once; (button, searchable name) pairs
+        self._emoji_buttons = []
+        for (sym, code), key in zip(self._emoji_items(), _EMOJI_KEYS):   # (symbol, code) tuples
+            btn = ttk.Button(frame, text=sym, width=3, style="Emoji.TButton")  # create button with emoji symbol
+            # Insert emoji symbol into entry and close window when clicked
+            def on_click(s=sym):
+                self._insert_symbol(s)  # insert emoji into typing entry
+                hide()
+            
+            btn.configure(command=on_click)  # bind click event
+            self._emoji_buttons.append((btn, key))
+
+        # Grid cell each button is shown in (None: hidden), so a keystroke only touches the
+        # buttons whose place actually changes
+        cells = [None] * len(self._emoji_buttons)
 
-        def render(items):
+        def render(q=""):
             """
-            Render grid of emoji buttons inside the emoji frame
-            Args:
-                items: List of (symbol, code) tuples
+            Lay out the emoji buttons matching q (all if empty) in the grid; the others are
+            only removed from the grid (grid_remove), not destroyed
             """
-            # Delete all old buttons
-            for child in frame.winfo_children():
-                child.destroy()
-            
             cols = 7  # 7 columns
-            r = c = 0
-            for sym, code in items:  # iterate over filtered emojis
-                btn = ttk.Button(frame, text=sym, width=3, style="Emoji.TButton")  # create button with emoji symbol
-                # Insert emoji symbol into entry and close window when clicked
-                def on_click(s=sym, w=win):
-                    self._insert_symbol(s)  # insert emoji into typing entry
-                    try:
-                        w.destroy()
-                    except Exception:
-                        pass
-                
-                btn.configure(command=on_click)  # bind click event
-                btn.grid(row=r, column=c, padx=4, pady=4)  # place button in grid
-                c += 1   # next column
-                if c >= cols: # wrap to next row
-                    r += 1
-                    c = 0
-
-        def do_filter(*_): # filter function by search query
-            """
-            Filter emojis by search keyword
-            """
-            q = query.get().strip().lower()
-            if not q:
-                # No query -> display all
-                render(all_items)
-                return
-            # Filter emojis containing keyword in code (remove : and replace _ with space)
-            filtered = [it for it in all_items if q in it[1].strip(":").replace("_", " ")]
-            render(filtered)
-
-        # Bind filter function with search entry
-        query.trace_add("write", lambda *_: do_filter())
+            i = 0
+            for k, (btn, name) in enumerate(self._emoji_buttons):
+                if q and q not in name:
+                    if cells[k] is not None:
+                        btn.grid_remove()
+                        cells[k] = None
+                    continue
+                cell = divmod(i, cols)
+                if cells[k] != cell:
+                    btn.grid(row=cell[0], column=cell[1], padx=4, pady=4)  # place button in grid
+                    cells[k] = cell
+                i += 1
+
+        # Filter emojis by search keyword on every change of the search entry
+        query.trace_add("write", lambda *_: render(query.get().strip().lower()))
         
         # Render all emojis initially
-        render(all_items)
+        render()
         
         # Focus on search entry so user can type immediately
         ent.focus_set()
 
+    def _place_emoji_picker(self, win):
+        ''' Move the picker next to the mouse (near the emoji button) and remember the entry cursor '''
+        # Position window near mouse cursor (near emoji button)
+        try:
+            x = self.winfo_pointerx()
+            y = self.winfo_pointery()
+            win.geometry(f"360x280+{x-190}+{y-350}")
+        except Exception:
+            win.geometry("360x280")
+
+        # Save cursor position in entry to insert emoji at correct position
+        try:
+            self._emoji_insert_pos = self.entry.index("insert")
+        except Exception:
+            self._emoji_insert_pos = None
+
     def _insert_symbol(self, symbol: str):
         """
         Insert emoji symbol into entry at saved cursor position
@@ -701,34 +981,12 @@ class ChatUI(tk.Tk):
 
     def _emoji_items(self):
         """
-        Return list of popular emojis with symbol and code
+        Return popular emojis with symbol and code (built once at import, see _EMOJI_ITEMS)
         Returns:
-            List of (symbol, code) tuples
+            Tuple of (symbol, code) tuples
             Example: [("😀", ":grinning:"), ("😊", ":smile:"), ...]
         """
-        # List of popular emoji codes (alias format)
-        codes = [
-            ":grinning:", ":smiley:", ":smile:", ":grin:", ":sweat_smile:", ":joy:", ":rofl:",
-            ":relaxed:", ":blush:", ":slightly_smiling_face:", ":upside_down_face:", ":wink:", ":relieved:", ":heart_eyes:", ":kissing_heart:",
-            ":kissing:", ":kissing_smiling_eyes:", ":kissing_closed_eyes:", ":yum:", ":stuck_out_tongue:", ":stuck_out_tongue_winking_eye:",
-            ":stuck_out_tongue_closed_eyes:", ":money_mouth_face:", ":hugs:", ":nerd_face:", ":sunglasses:", ":star_struck:",
-            ":thinking:", ":zipper_mouth_face:", ":neutral_face:", ":expressionless:", ":no_mouth:", ":smirk:", ":unamused:",
-            ":roll_eyes:", ":grimacing:", ":lying_face:", ":pensive:", ":sleepy:", ":sleeping:", ":sweat:",
-            ":cry:", ":sob:", ":disappointed_relieved:", ":cold_sweat:", ":fearful:", ":scream:", ":confounded:", ":persevere:",
-            ":triumph:", ":angry:", ":rage:", ":clap:", ":raised_hands:", ":wave:", ":thumbs_up:", ":thumbs_down:", ":ok_hand:",
-            ":pray:", ":muscle:", ":heart:", ":orange_heart:", ":yellow_heart:", ":green_heart:", ":blue_heart:", ":purple_heart:",
-            ":black_heart:", ":white_heart:", ":sparkles:", ":fire:", ":star:", ":zap:", ":tada:", ":confetti_ball:", ":rocket:",
-        ]
-        
-        items = []
-        for c in codes:
-            try:
-                # Convert emoji code to symbol
-                items.append((emoji.emojize(c, language="alias"), c))
-            except Exception:
-                # Skip emoji if emojize fails
-                pass
-        return items
+        return _EMOJI_ITEMS
 
     def send_file(self):
         broadcast = False
@@ -749,18 +1007,19 @@ class ChatUI(tk.Tk):
             return
         
         size = os.path.getsize(path)
-        filename = os.path.basename(path)
         
         # Create unique file_id for this file
         file_id = str(uuid.uuid4())    # a unique id for this file transfer is created
+        meta = file_offer_meta(path, size, file_id, CHUNK)   # built once, reused for the offer and the messages
+        filename = meta["name"]
         
         if broadcast:
             # Send to all users
-            self.net.send_file_offer("*", path, size, file_id)
+            self.net.send_file_offer("*", path, size, file_id, meta=meta)
             self.append(f"(System) ({self.ts()}) Sending file '{filename}' ({self._format_size(size)}) to all users...", "system")
         else:
             # Send to specific user
-            self.net.send_file_offer(to_user, path, size, file_id)
+            self.net.send_file_offer(to_user, path, size, file_id, meta=meta)
             self.append(f"(System) ({self.ts()}) Sending file '{filename}' ({self._format_size(size)}) to {to_user}...", "system")
 
         # Save file to be ready for upload when someone accepts
@@ -768,82 +1027,116 @@ class ChatUI(tk.Tk):
 
     # --------- incoming messages ----------
     def _on_message(self, env: Dict[str, Any]):
+        '''
+        Handle one envelope. Runs on NetClient's dispatch thread, not the Tk thread: decryption
+        and parsing happen here, and widget work is handed to Tk with after() (append() and the
+        userlist flush already queue their updates that way).
+        '''
         t = env.get("type")
-        if t == "system":
-            # Include timestamp for system notifications (join/leave, etc.)
-            self.append(f"(System) ({self._hhmm(env)}) {env['payload'].get('text','')}", "system")
-            return
-        if t == "userlist":
-            users = env["payload"]["users"]
-            
-            # Delete all widgets in user_frame
-            for widget in self.user_frame.winfo_children():
-                widget.destroy()
-            
-            # Update user_avatars mapping
-            self.user_avatars.clear()
-            usernames_in_list = []
-            
-            # Create item for each user with circular avatar + name
-            for i, user_info in enumerate(users):
-                # user_info can be dict {"username": ..., "avatar_id": ...} or string (legacy)
-                if isinstance(user_info, dict):
-                    username = user_info["username"]
-                    avatar_id = user_info.get("avatar_id", 0)
-                else:
-                    username = user_info
-                    avatar_id = 0
-                
-                self.user_avatars[username] = avatar_id
-                print(f"[DEBUG] User: {username}, avatar_id: {avatar_id}")  # Debug
-                usernames_in_list.append(username)
-                
-                # Create frame for each user item
-                user_frame = tk.Frame(self.user_frame, bg="white", cursor="hand2")
-                # Pack each user row aligned to the left; allow horizontal expansion
-                user_frame.pack(pady=3, padx=6, anchor="w", fill="x")
-                
-                # Load circular avatar
-                avatar_img = self._load_avatar(avatar_id, size=40)
-                
-                # Avatar label
-                avatar_label = tk.Label(user_frame, image=avatar_img, bg="white")
-                avatar_label.image = avatar_img  # Keep reference
-                avatar_label.pack(side="left", padx=(5, 10))
-                
-                # Username label
-                name_label = tk.Label(user_frame, text=username, bg="white", font=("Segoe UI", 13), anchor="w")
-                name_label.pack(side="left")
-                
-                # Bind click to select user (for private message or send file)
-                def _on_user_click(event, u=username):
-                    self._select_user(u)
-                    return "break"  # stop event propagation so background doesn't clear
-                user_frame.bind("<Button-1>", _on_user_click)
-                avatar_label.bind("<Button-1>", _on_user_click)
-                name_label.bind("<Button-1>", _on_user_click)
-                
-                # Highlight if this is the selected user
-                if self.selected_user == username:
-                    user_frame.config(bg="#e3f2fd")
-                    avatar_label.config(bg="#e3f2fd")
-                    name_label.config(bg="#e3f2fd")
-            
-            # If previously selected user is no longer present, clear selection
-            if self.selected_user and self.selected_user not in usernames_in_list:
-                self.selected_user = None
-            
-            # Bind background click (empty space) to clear selection
-            try:
-                self.user_frame.bind("<Button-1>", lambda e: self._clear_selection())
-            except Exception:
-                pass
-            
+        handler = self._handlers.get(t)
+        if handler is not None:
+            handler(env)   # plaintext messages from the server
             return
         
         # Call helper to process encrypted messages
         self._process_encrypted_message(env, t)
-    
+
+    def _h_system(self, env: Dict[str, Any]):
+        ''' Server notice (join/leave, etc.) '''
+        # Include timestamp for system notifications (join/leave, etc.)
+        self.append(f"(System) ({self._hhmm(env)}) {env['payload'].get('text','')}", "system")
+
+    def _h_userlist(self, env: Dict[str, Any]):
+        ''' Users online '''
+        # Bursts of userlist messages (several joins at once) are drawn once, with the latest list
+        self._pending_userlist = env["payload"]["users"]
+        with self._jobs_lock:
+            if self._userlist_job:
+                return
+            self._userlist_job = True
+        self.after(USERLIST_DEBOUNCE_MS, self._flush_userlist)
+
+    def _flush_userlist(self):
+        ''' Draw the most recent userlist received (scheduled by _on_message) '''
+        # Clear the flag first: a userlist arriving while we draw schedules a new flush
+        with self._jobs_lock:
+            self._userlist_job = False
+        self._update_user_list(self._pending_userlist or [])
+
+    def _update_user_list(self, users):
+        ''' Bring the Active list in line with users (list of {"username", "avatar_id"} or names) '''
+        # Update user_avatars mapping
+        self.user_avatars.clear()
+        usernames_in_list = []
+        for user_info in users:
+            # user_info can be dict {"username": ..., "avatar_id": ...} or string (legacy)
+            if isinstance(user_info, dict):
+                username = user_info["username"]
+                avatar_id = user_info.get("avatar_id", 0)
+            else:
+                username = user_info
+                avatar_id = 0
+            if username not in self.user_avatars:
+                usernames_in_list.append(username)
+            self.user_avatars[username] = avatar_id
+
+        # Diff against the rows on screen: only rows of users who left are destroyed and only
+        # rows of new users are built; rows that stay are kept (avatar swapped if it changed)
+        for username in [u for u in self._user_rows if u not in self.user_avatars]:
+            self._user_rows.pop(username)["widget"].destroy()
+            if username == self._highlighted_user:
+                self._highlighted_user = None   # a row built again later starts unhighlighted
+        for username in usernames_in_list:
+            avatar_id = self.user_avatars[username]
+            row = self._user_rows.get(username)
+            if row is None:
+                self._user_rows[username] = self._build_user_row(username, avatar_id)
+            elif row["avatar_id"] != avatar_id:
+                avatar_img = self._load_avatar(avatar_id, size=40)
+                row["widget"].configure(image=avatar_img)
+                row["widget"].image = avatar_img  # Keep reference
+                row["avatar_id"] = avatar_id
+
+        # Keep the server's order; re-pack (no rebuild) only if it differs from what is shown.
+        # Tk's pack takes any number of widgets, so that is two Tcl calls for the whole list
+        if list(self._user_rows) != usernames_in_list:
+            self._user_rows = {u: self._user_rows[u] for u in usernames_in_list}
+            paths = [str(row["widget"]) for row in self._user_rows.values()]
+            if paths:
+                self.tk.call("pack", "forget", *paths)
+                self.tk.call("pack", *paths, "-pady", 3, "-padx", 6, "-anchor", "w", "-fill", "x")
+
+        # If previously selected user is no longer present, clear selection
+        if self.selected_user and self.selected_user not in self.user_avatars:
+            self.selected_user = None
+        self._refresh_user_highlight()
+
+    def _build_user_row(self, username: str, avatar_id: int) -> Dict[str, Any]:
+        '''
+        Create (and pack) the Active list row for one user: a single Label showing the circular
+        avatar and the name side by side (compound), so each row is one widget for Tk to lay out
+        '''
+        # Load circular avatar
+        avatar_img = self._load_avatar(avatar_id, size=40)
+
+        row = tk.Label(self.user_frame, image=avatar_img, text=username, compound="left", bg="white",
+                       font=("Segoe UI", 13), anchor="w", padx=5, cursor="hand2")
+        row.image = avatar_img  # Keep reference
+        row._chat_username = username   # read back by _on_user_click
+        # Pack each user row aligned to the left; allow horizontal expansion
+        row.pack(pady=3, padx=6, anchor="w", fill="x")
+
+        # Click selects the user (for private message or send file), via the shared row tag
+        row.bindtags((self._user_row_tag,) + row.bindtags())
+        return {"widget": row, "avatar_id": avatar_id}
+
+    def _on_user_click(self, event):
+        ''' Click on an Active list row: select that user '''
+        username = getattr(event.widget, "_chat_username", None)
+        if username is not None:
+            self._select_user(username)
+        return "break"  # stop event propagation so background doesn't clear
+
     def _select_user(self, username: str):
         """Select or toggle-select a user from the Active list.
         Clicking the already selected user will unselect it."""
@@ -864,117 +1157,242 @@ class ChatUI(tk.Tk):
         self._refresh_user_highlight()
 
     def _refresh_user_highlight(self):
-        """Apply highlight background to the selected user and reset others."""
-        target = self.selected_user
-        for widget in self.user_frame.winfo_children():
-            if isinstance(widget, tk.Frame):
-                # Find the username label inside this frame
-                frame_username = None
-                for child in widget.winfo_children():
-                    if isinstance(child, tk.Label) and child.cget("text"):
-                        # This is the name label if it has text
-                        frame_username = child.cget("text")
-                        break
-                is_selected = (target is not None and frame_username == target)
-                bg_color = "#e3f2fd" if is_selected else "white"
-                widget.config(bg=bg_color)
-                for child in widget.winfo_children():
-                    child.config(bg=bg_color)
-    
+        """Apply highlight background to the selected user and reset the previous one."""
+        # Only the row painted before and the selected row are touched (no pass over all rows)
+        target = self.selected_user if self.selected_user in self._user_rows else None
+        if target == self._highlighted_user:
+            return
+        old = self._user_rows.get(self._highlighted_user)
+        if old is not None:
+            old["widget"].config(bg="white")
+        if target is not None:
+            self._user_rows[target]["widget"].config(bg="#e3f2fd")
+        self._highlighted_user = target
+
     def _process_encrypted_message(self, env: Dict[str, Any], t: str):
         """Process encrypted messages"""
+        handler = self._encrypted_handlers.get(t)
+        if handler is None:
+            return
+        # Cheap envelope checks first, so frames that cannot (or need not) be decrypted cost
+        # neither an AES-GCM pass nor an exception: no session yet, no encrypted payload, or a
+        # private message or file frame for someone else
+        cipher = self.net.session_cipher
+        payload = env.get("payload")
+        raw = t in self._RAW_BODY_TYPES   # binary frame: nonce in the payload, ciphertext in "data"
+        if cipher is None or not isinstance(payload, dict) or ("bin" if raw else "enc") not in payload:
+            return
+        if raw and "data" not in env:
+            return
+        if t in self._DIRECTED_TYPES and env.get("to") != self.username:
+            return
         # encrypted payloads
         try:
-            body = decrypt_body(self.net.session_key, env["payload"])
+            body = decrypt_bin(cipher, payload, env["data"]) if raw else decrypt_body(cipher, payload)
         except Exception:
-            # during handshake some messages are plaintext or not for us
+            # corrupted or encrypted with another key
             return
-
-        if t == "pub":
-            self.append(f"(Global) ({self._hhmm(env)}) {env['sender']}: {body['text']}", "public")
-        elif t == "priv":
-            if env['to'] == self.username:
-                self.append(f"(Private) (From {env['sender']}) ({self._hhmm(env)}): {body['text']}", "private")
-        elif t == "file_offer":
-            # Received notification that a file has been sent
-            name = body["name"]
-            size = body["size"]
-            file_type = body.get("type", "unknown")
-            sender = env['sender']
-            file_id = body.get("file_id", str(uuid.uuid4()))
-            
-            # Save file information for later download
-            if not hasattr(self, 'available_files'):
-                self.available_files = {}
-            
-            self.available_files[file_id] = {
-                "name": name,
-                "size": size,
-                "type": file_type,
-                "sender": sender,
-                "file_id": file_id
-            }
-            
-            # Show accept/reject dialog to user
-            self._show_file_offer_dialog(sender, name, size, file_type, file_id)
+        handler(env, body)
+
+    def _h_pub(self, env: Dict[str, Any], body: Dict[str, Any]):
+        ''' Public message '''
+        self.append(f"(Global) ({self._hhmm(env)}) {env['sender']}: {body['text']}", "public")
+
+    def _h_priv(self, env: Dict[str, Any], body: Dict[str, Any]):
+        ''' Private message (frames for other users were dropped before decryption) '''
+        self.append(f"(Private) (From {env['sender']}) ({self._hhmm(env)}): {body['text']}", "private")
+
+    def _h_file_offer(self, env: Dict[str, Any], body: Dict[str, Any]):
+        ''' Received notification that a file has been sent '''
+        name = body["name"]
+        size = body["size"]
+        file_type = body.get("type", "unknown")
+        sender = env['sender']
+        file_id = body.get("file_id") or str(uuid.uuid4())
+        
+        # Save file information for later download
+        self.available_files[file_id] = {
+            "name": name,
+            "size": size,
+            "chunk": body.get("chunk", 0),   # sender's bytes per chunk, if announced
+            "type": file_type,
+            "sender": sender,
+            "file_id": file_id
+        }
+        
+        # Show accept/reject dialog to user (on the Tk thread)
+        self.after(0, self._show_file_offer_dialog, sender, name, size, file_type, file_id)
+
+    def _h_file_ack(self, env: Dict[str, Any], body: Dict[str, Any]):
+        ''' Answer to one of our file offers '''
+        if not body.get("accept"):    # If the file offer is not accepted
+            # Receiver declined the file
+            self.append(f"(System) ({self.ts()}) {env['sender']} declined your file.", "system")
+        else:
+            # Receiver accepted - start upload to the ACK sender (works for direct or broadcast offers)
+            if not self.current_upload:
+                return
+            fid = body["id"]
+            path = self.current_upload["path"]
+            to_user = env["sender"]
             
-        elif t == "file_ack":
-            if not body.get("accept"):    # If the file offer is not accepted
-                # Receiver declined the file
-                self.append(f"(System) ({self.ts()}) {env['sender']} declined your file.", "system")
+            # Show upload starting message
+            self.append(f"(System) ({self.ts()}) Sending file to {to_user}...", "system")
+            self._stream_upload(to_user, fid, path, binary=bool(body.get("binary")))
+
+    def _h_file_chunk(self, env: Dict[str, Any], body: Dict[str, Any]):
+        ''' One chunk of a file we are downloading '''
+        if body.get("encoding") == "base64":
+            ch = b64d(body["data"])
+        else:
+            ch = body["data"].encode("latin1")  # older clients: decode from latin1 back to bytes
+        self._write_chunk(body["id"], body["seq"], ch, body["final"])
+
+    def _h_file_chunk_bin(self, env: Dict[str, Any], body: bytes):
+        ''' One binary chunk (FILE_CHUNK_HEADER + data) of a file we are downloading '''
+        fid, seq, final = FILE_CHUNK_HEADER.unpack_from(body)
+        self._write_chunk(str(uuid.UUID(bytes=fid)), seq, memoryview(body)[FILE_CHUNK_HEADER.size:], final)
+
+    def _write_chunk(self, fid: str, seq: int, ch: "bytes | memoryview", final: bool):
+        '''
+        Store chunk seq of download fid. Runs on NetClient's dispatch thread like the other
+        handlers: the Tk thread only hears about a download when it is complete or has failed.
+        '''
+        if fid in self._failed_downloads:
+            return   # the rest of a download that was given up
+        ctx = self.current_downloads.get(fid)   # get current download context
+        if not ctx:
+            # first chunk without offer? initialize
+            self.current_downloads[fid] = ctx = self._new_download("file.bin")
+        try:
+            done = self._store_chunk(ctx, seq, ch, final)
+        except OSError as e:   # e.g. disk full
+            self._abort_download(fid, ctx, e)
+            return
+        if done:
+            # Clean up download context; the save dialog runs on the Tk thread
+            del self.current_downloads[fid]
+            self.after(0, self._save_download, ctx)
+
+    def _store_chunk(self, ctx: Dict[str, Any], seq: int, ch: "bytes | memoryview", final: bool) -> bool:
+        ''' Write chunk seq into the download's temp file; True once the file is complete (and closed) '''
+        if final:
+            ctx["last"] = seq
+        chunk = ctx["chunk"]
+        if chunk:
+            # Chunk size known from the offer: every chunk goes straight to its place in the
+            # file, in whatever order it arrives; a bitmap of the seqs received catches duplicates
+            got, byte, bit = ctx["got"], seq >> 3, 1 << (seq & 7)
+            if byte >= len(got):
+                got.extend(bytes(byte + 1 - len(got)))
+            if not got[byte] & bit:
+                got[byte] |= bit
+                if len(ch):   # (an empty final chunk just marks the end)
+                    off = seq * chunk
+                    if off != ctx["pos"]:
+                        ctx["fp"].seek(off)
+                    ctx["fp"].write(ch)
+                    ctx["pos"] = off + len(ch)
+                    ctx["end"] = max(ctx["end"], ctx["pos"])
+                ctx["next"] += 1   # chunks received (seqs 0..last, each once)
+        # Otherwise chunks are written to the temp file as they arrive, in order; only chunks
+        # that arrive ahead of a gap are held in memory until the gap is filled
+        elif seq == ctx["next"]:
+            fp, pending = ctx["fp"], ctx["pending"]
+            fp.write(ch)
+            ctx["next"] = seq = seq + 1
+            while seq in pending:
+                fp.write(pending.pop(seq))
+                ctx["next"] = seq = seq + 1
+        elif seq > ctx["next"]:
+            ctx["pending"][seq] = ch
+        # Done once everything up to the final chunk is on disk, even if the final
+        # chunk itself overtook an earlier one
+        if ctx["next"] > ctx["last"]:
+            # drop any preallocated space past the data actually received
+            ctx["fp"].truncate(ctx["end"] if chunk else None)
+            ctx["fp"].close()
+            return True
+        return False
+
+    def _abort_download(self, fid: str, ctx: Dict[str, Any], err: Exception):
+        ''' Give up download fid after a write error: drop its temp file and tell the user once '''
+        del self.current_downloads[fid]
+        self._failed_downloads.add(fid)   # its remaining chunks are ignored
+        try:
+            ctx["fp"].close()
+        except OSError:
+            pass
+        try:
+            os.remove(ctx["tmp"])
+        except OSError:
+            pass
+        self.append(f"(System) ({self.ts()}) Download of '{ctx['name']}' failed: {err}", "system")
+
+    def _stream_upload(self, to_user: str, fid: str, path: str, binary: bool = False):
+        '''
+        Upload path to to_user as file fid. Reading (readinto a reused buffer), encryption and
+        socket writes run on NetClient's worker threads, so neither the UI nor the thread that
+        delivered the ack is blocked for the whole upload; the result is posted back with after().
+        '''
+        name = os.path.basename(path)
+        def _upload_done(err):
+            if err:
+                msg = f"(System) ({self.ts()}) Sending '{name}' to {to_user} failed: {err}"
             else:
-                # Receiver accepted - start upload to the ACK sender (works for direct or broadcast offers)
-                if not self.current_upload:
-                    return
-                fid = body["id"]
-                path = self.current_upload["path"]
-                to_user = env["sender"]
-                
-                # Show upload starting message
-                self.append(f"(System) ({self.ts()}) Sending file to {to_user}...", "system")
-                
-                seq = 0
-                with open(path, "rb") as f:
-                    while True:
-                        b = f.read(CHUNK)   # read file in chunks: each chunk is up to CHUNK bytes ( 32* 1024 = 32KB )
-                        if not b: 
-                            # send an empty final chunk marker (bytes)
-                            self.net.send_file_chunk(to_user, fid, seq, b"", True)
-                            break
-                        # send raw bytes; NetClient will latin1-encode for JSON
-                        self.net.send_file_chunk(to_user, fid, seq, b, False)
-                        seq += 1
-                self.append(f"(System) ({self.ts()}) Finished sending '{os.path.basename(path)}' to {to_user}.", "system")
-        elif t == "file_chunk":  # if received a file chunk
-            fid, seq, final = body["id"], body["seq"], body["final"]
-            ch = body["data"].encode("latin1")  # decode from latin1 back to bytes
-            ctx = self.current_downloads.get(fid)   # get current download context
-            if not ctx:
-                # first chunk without offer? initialize
-                self.current_downloads[fid] = ctx = {"name":"file.bin","chunks":{}, "next":0}
-            ctx["chunks"][seq] = ch
-            if final:   # when final chunk is received, reconstruct file
-                # All chunks received - reconstruct file in order
-                ordered = bytearray()
-                for i in range(len(ctx["chunks"])):
-                    ordered.extend(ctx["chunks"][i])
-                
-                # Ask user where to save the file
-                save = filedialog.asksaveasfilename(
-                    defaultextension="",
-                    initialfile=ctx["name"],
-                    title=f"Save file: {ctx['name']}"
-                )
-                
-                if save:
-                    with open(save, "wb") as f:
-                        f.write(ordered)
-                    self.append(f"(System) ({self.ts()}) File saved to: {save}", "system")
-                else:
-                    self.append(f"(System) ({self.ts()}) File download cancelled.", "system")
-                
-                # Clean up download context
-                del self.current_downloads[fid]
+                msg = f"(System) ({self.ts()}) Finished sending '{name}' to {to_user}."
+            self.after(0, self.append, msg, "system")   # arguments passed to after(), no lambda
+        self.net.start_file_sender(to_user, fid, path, CHUNK, on_done=_upload_done, binary=binary)
+
+    def _new_download(self, name: str, size: int = 0, chunk: int = 0) -> Dict[str, Any]:
+        '''
+        Download context for a file called name: chunks are streamed into a temp file. With the
+        announced size, the file's disk space is reserved up front in one extent instead of
+        being grown chunk by chunk (best effort; the file is truncated to the data on completion).
+        With the sender's chunk size, chunks are written at their offset (see _write_chunk).
+        '''
+        fd, tmp = tempfile.mkstemp(prefix="chat_", suffix=".part")
+        if isinstance(size, int) and size > 0 and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except (OSError, OverflowError):
+                pass   # e.g. not enough space or not supported: the file just grows as written
+        if not (isinstance(chunk, int) and chunk > 0):
+            chunk = 0
+        # seqs 0..size // chunk (one more if the upload ends with an empty final chunk)
+        nchunks = size // chunk + 1 if chunk and isinstance(size, int) and size > 0 else 1
+        return {"name": name, "tmp": tmp, "fp": os.fdopen(fd, "wb"),
+                "next": 0,        # seq expected next in the file (with chunk: chunks received)
+                "last": float("inf"),   # seq of the final chunk, once it has arrived
+                "pending": {},    # seq -> chunk received ahead of a missing one
+                "chunk": chunk,   # bytes per chunk, 0 if unknown
+                "got": bytearray((nchunks + 7) // 8),   # bitmap of the seqs received (with chunk)
+                "pos": 0, "end": 0}   # file position and end of the data written (with chunk)
+
+    def _save_download(self, ctx: Dict[str, Any]):
+        ''' Ask the user where to save a finished download and move the temp file there (Tk thread) '''
+        tmp = ctx["tmp"]
+        if ctx["pending"]:
+            self.append(f"(System) ({self.ts()}) File '{ctx['name']}' is incomplete (chunk {ctx['next']} missing).", "system")
+            os.remove(tmp)
+            return
+        
+        # Ask user where to save the file
+        save = filedialog.asksaveasfilename(
+            defaultextension="",
+            initialfile=ctx["name"],
+            title=f"Save file: {ctx['name']}"
+        )
+        
+        if save:
+            try:
+                os.replace(tmp, save)      # same file system: a rename, no copy
+            except OSError:
+                shutil.move(tmp, save)     # e.g. temp dir on another drive
+            self.append(f"(System) ({self.ts()}) File saved to: {save}", "system")
+        else:
+            os.remove(tmp)
+            self.append(f"(System) ({self.ts()}) File download cancelled.", "system")
 
     def _append_file_message(self, sender: str, filename: str, size: int, file_id: str):
         """
@@ -983,38 +1401,26 @@ class ChatUI(tk.Tk):
         - Filename is underlined, bold and clickable to download
         - No separate download button needed
         """
-        self.text.configure(state="normal")
-        
         # Prefix part: (Global) sender sent a file: 
         prefix = f"(Global) {sender} sent a file: "
-        self.text.insert("end", prefix, "public")
-        
-        # Filename: underlined + bold + clickable
-        # Create unique tag for each file to bind click event
+        # Filename: underlined + bold + clickable (bindings live on the shared "file_name" tag)
+        # Unique tag for each file, so a click knows which file it was
         file_tag = f"file_{file_id}"
-        self.text.insert("end", filename, ("file_name", file_tag))
-        
-        # Configure style for filename
-        self.text.tag_config("file_name", underline=True, font=("Segoe UI Emoji", 11, "bold"), foreground="#2a64cb")
-        
-        # Bind click event to this tag
-        self.text.tag_bind(file_tag, "<Button-1>", lambda e, fid=file_id: self._download_file(fid))
-        
-        # Change cursor to hand when hovering
-        self.text.tag_bind(file_tag, "<Enter>", lambda e: self.text.config(cursor="hand2"))
-        self.text.tag_bind(file_tag, "<Leave>", lambda e: self.text.config(cursor=""))
-        
-        # New line after message
-        self.text.insert("end", "\n")
-        
-        self.text.configure(state="disabled")
-        self.text.see("end")
+        # Queued with the other lines, so it shares their single insert (and stays in order)
+        self._queue_segments((prefix, ("public",), filename, ("file_name", file_tag), "\n", ()))
+
+    def _on_file_link_click(self, event):
+        ''' Click on a file name in the chat: download the file of the file_<id> tag under the mouse '''
+        for tag in self.text.tag_names("current"):
+            if tag.startswith("file_") and tag not in ("file_name", "file_msg"):
+                self._download_file(tag[len("file_"):])
+                break
 
     def _download_file(self, file_id: str):
         """
         Handle when user clicks Download button
         """
-        if not hasattr(self, 'available_files') or file_id not in self.available_files:
+        if file_id not in self.available_files:
             messagebox.showwarning("Error", "File does not exist or has expired.")
             return
         
@@ -1022,19 +1428,12 @@ class ChatUI(tk.Tk):
         sender = file_info["sender"]
         filename = file_info["name"]
         
+        # Initialize context to receive chunks (before the ACK: chunks may arrive right after it)
+        self.current_downloads[file_id] = self._new_download(filename, file_info.get("size", 0), file_info.get("chunk", 0))
+        
         # Send ACK accepting download
         self.net.send_file_ack(sender, file_id, True)
         
-        # Initialize context to receive chunks
-        if not hasattr(self, 'current_downloads'):
-            self.current_downloads = {}
-        
-        self.current_downloads[file_id] = {
-            "name": filename,
-            "chunks": {},
-            "next": 0
-        }
-        
         self.append(f"(System) ({self.ts()}) Downloading file '{filename}' from {sender}...", "system")
 
     def _hhmm(self, env):
@@ -1042,20 +1441,4 @@ class ChatUI(tk.Tk):
         ts = env.get("ts")
         if not ts:
             return "--:--:--"
-        try:
-            s = ts
-            # Support ISO strings with trailing 'Z' (UTC)
-            if s.endswith("Z"):
-                s = s.replace("Z", "+00:00")
-            dt = datetime.datetime.fromisoformat(s)
-            if dt.tzinfo is None:
-                # Treat naive timestamps as UTC
-                dt = dt.replace(tzinfo=datetime.timezone.utc)
-            local_dt = dt.astimezone()  # convert to local timezone
-            return local_dt.strftime("%H:%M:%S")
-        except Exception:
-            # Fallback to substring if parsing fails
-            try:
-                return ts[11:19]
-            except Exception:
-                return "--:--:--"
\ No newline at end of file
+        return _fmt_ts(ts)
\ No newline at end of file
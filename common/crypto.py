@@ -1,9 +1,20 @@
-import base64, json, os
+import binascii, os
 from typing import Tuple
 
+try:
+    import pybase64   # optional SIMD (AVX2/NEON) Base64, several times faster than binascii
+except ImportError:
+    pybase64 = None
+
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from common.protocol import encode_json_body, decode_json   # orjson when installed
+
+# OAEP padding for wrapping/unwrapping AES keys; immutable, so one instance serves every handshake
+_OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()),
+                     algorithm=hashes.SHA256(),
+                     label=None)
 
 
 def rsa_generate(bits: int = 2048):
@@ -41,12 +52,7 @@ def rsa_wrap_key(pub_pem: str, key_bytes: bytes) -> str:
     # Load the public key from PEM
     pub = serialization.load_pem_public_key(pub_pem.encode())
     # Encrypt the AES key using RSA public key
-    wrapped = pub.encrypt(
-        key_bytes,
-        padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                     algorithm=hashes.SHA256(),
-                     label=None)
-    )
+    wrapped = pub.encrypt(key_bytes, _OAEP)
     return b64(wrapped)  # binary ciphertext for AES key
 
 def rsa_unwrap_key(priv, wrapped_b64: str) -> bytes:
@@ -58,45 +64,60 @@ def rsa_unwrap_key(priv, wrapped_b64: str) -> bytes:
     Output: the unwrapped AES key in bytes
     '''
     wrapped = b64d(wrapped_b64)
-    return priv.decrypt(
-        wrapped,
-        padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                     algorithm=hashes.SHA256(),
-                     label=None)
-    )
+    return priv.decrypt(wrapped, _OAEP)
 
 def aes_key() -> bytes:
     '''This function generates a random 256-bit AES key'''
     return AESGCM.generate_key(bit_length=256)
 
+def aes_cipher(key) -> AESGCM:
+    '''
+    This function returns an AESGCM object (OpenSSL, AES-NI accelerated) for a key.
+    Callers that use one key for many messages should create it once and pass it to
+    aes_encrypt/aes_decrypt/encrypt_body/decrypt_body instead of the raw key bytes.
+    Input: AES key in bytes, or an existing AESGCM object (returned as is)
+    '''
+    return key if isinstance(key, AESGCM) else AESGCM(key)
+
 def aes_encrypt(key: bytes, plaintext: bytes, aad: bytes = b"") -> Tuple[str,str,str]:
     '''
     This function encrypts plaintext using AES-GCM. 
     Input:
-        - key: AES key in bytes (256 bits)
+        - key: AES key in bytes (256 bits) or its AESGCM object (see aes_cipher)
         - plaintext: data to encrypt in bytes
         - aad: additional authenticated data (optional, bytes)
     Output: tuple of Base64 strings (nonce, ciphertext, tag)
     '''
-    # Create AESGCM object using provided key
-    aes = AESGCM(key)   # cipher instance that can both encrypt and decrypt
+    # Create AESGCM object using provided key (or reuse the caller's)
+    aes = aes_cipher(key)   # cipher instance that can both encrypt and decrypt
     nonce = os.urandom(12)  # random 96-bit nonce
-    ct = aes.encrypt(nonce, plaintext, aad)  # returns ct||tag
-    # cryptography puts tag at the end; but for transport we keep as one blob
+    ct = memoryview(aes.encrypt(nonce, plaintext, aad))  # returns ct||tag
+    # cryptography puts tag at the end; the two parts are Base64-coded from views into it,
+    # without copying the ciphertext into a separate bytes object first
     return b64(nonce), b64(ct[:-16]), b64(ct[-16:])      # nonce, ciphertext, tag
 
+def aes_encrypt_b64(key, plaintext: bytes, aad: bytes = b"") -> Tuple[bytes, bytes, bytes]:
+    '''
+    Same as aes_encrypt, but returns the Base64 parts as ASCII bytes, for callers that
+    write them straight into an encoded frame (no str round trip).
+    '''
+    aes = aes_cipher(key)
+    nonce = os.urandom(12)
+    ct = memoryview(aes.encrypt(nonce, plaintext, aad))
+    return b64_bytes(nonce), b64_bytes(ct[:-16]), b64_bytes(ct[-16:])
+
 def aes_decrypt(key: bytes, nonce_b64: str, ct_b64: str, tag_b64: str, aad: bytes = b"") -> bytes:
     '''
     This function decrypts ciphertext using AES-GCM.
     Input:
-        - key: AES key in bytes (256 bits)
+        - key: AES key in bytes (256 bits) or its AESGCM object (see aes_cipher)
         - nonce_b64: Base64 string of the nonce
         - ct_b64: Base64 string of the ciphertext
         - tag_b64: Base64 string of the authentication tag
         - aad: additional authenticated data (optional, bytes)
     Output: decrypted plaintext in bytes
     '''
-    aes = AESGCM(key)
+    aes = aes_cipher(key)
     nonce = b64d(nonce_b64)
     ct = b64d(ct_b64) + b64d(tag_b64)
     return aes.decrypt(nonce, ct, aad)
@@ -118,35 +139,76 @@ def unpack_encrypted(d: dict) -> Tuple[str,str,str]:
     e = d["enc"]
     return e["n"], e["c"], e["t"]
 
+def b64_bytes(b) -> bytes:
+    '''
+    This function encodes a bytes-like object (read in place, e.g. a memoryview) to Base64 as
+    ASCII bytes, for frames built as bytes. Uses pybase64 when it is installed.
+    '''
+    if pybase64 is not None:
+        return pybase64.b64encode(b)
+    return binascii.b2a_base64(b, newline=False)
+
 def b64(b: bytes) -> str:
     ''' This function encodes bytes to a Base64 string '''
-    return base64.b64encode(b).decode()
+    return b64_bytes(b).decode("ascii")
 
 def b64d(s: str) -> bytes:
-    ''' This function decodes a Base64 string to bytes '''
-    return base64.b64decode(s.encode())
+    '''
+    This function decodes a Base64 string to bytes. binascii (or pybase64) reads the ASCII
+    str directly, without the extra s.encode() copy (file chunks and ciphertexts go through here)
+    '''
+    if pybase64 is not None:
+        return pybase64.b64decode(s)
+    return binascii.a2b_base64(s)
 
 
 def encrypt_body(key: bytes, body: dict) -> dict: 
     ''' 
     This function encrypts a message body (dictionary) using AES-GCM and packs it.
     Input:
-        - key: AES key in bytes (256 bits)
+        - key: AES key in bytes (256 bits) or its AESGCM object
         - body: message body as a dictionary
     Output: dictionary with structure {"enc": {"n": nonce, "c": ciphertext, "t": tag}}
     '''
-    nonce, ct, tag = aes_encrypt(key, json.dumps(body, ensure_ascii=False).encode())
-    return pack_encrypted(nonce, ct, tag)
+    return encrypt_plain(key, encode_json_body(body))
 
 def decrypt_body(key: bytes, payload: dict) -> dict:
     ''' 
     This function unpacks and decrypts an encrypted message body using AES-GCM.
     Input:
-        - key: AES key in bytes (256 bits)
+        - key: AES key in bytes (256 bits) or its AESGCM object
         - payload: dictionary with structure {"enc": {"n": nonce, "c": ciphertext, "t": tag}}
     Output: decrypted message body as a dictionary
     '''
+    return decode_json(decrypt_plain(key, payload))
+
+def encrypt_plain(key, plaintext: bytes) -> dict:
+    '''
+    Same as encrypt_body for a body that is already JSON-encoded bytes (e.g. the server
+    forwarding a decrypt_plain result to several recipients: no JSON round trip per recipient)
+    '''
+    return pack_encrypted(*aes_encrypt(key, plaintext))
+
+def decrypt_plain(key, payload: dict) -> bytes:
+    ''' Same as decrypt_body, but the body is returned as its JSON-encoded bytes, not parsed '''
     n,c,t = unpack_encrypted(payload)
-    data = aes_decrypt(key, n, c, t)
-    return json.loads(data.decode())
+    return aes_decrypt(key, n, c, t)
 
+def encrypt_bin(key, data) -> Tuple[dict, bytes]:
+    '''
+    This function encrypts a body that is already bytes (binary file chunks) for a binary frame:
+    the ciphertext stays raw bytes instead of being Base64-coded into the JSON.
+    Input:
+        - key: AES key in bytes (256 bits) or its AESGCM object
+        - data: bytes-like body
+    Output: (payload {"bin": {"n": nonce}}, ciphertext with the 16-byte tag appended)
+    '''
+    nonce = os.urandom(12)
+    return {"bin": {"n": b64(nonce)}}, aes_cipher(key).encrypt(nonce, data, b"")
+
+def decrypt_bin(key, payload: dict, data) -> bytes:
+    '''
+    Counterpart of encrypt_bin: the decrypted body as bytes (no JSON parsing).
+    Input: payload {"bin": {"n": nonce}} and the raw ciphertext + tag of the frame
+    '''
+    return aes_cipher(key).decrypt(b64d(payload["bin"]["n"]), data, b"")
@@ -1,12 +1,235 @@
 import json
 import socket
+import struct
+import time
+from typing import Any, Dict, List
+
+try:
+    import orjson   # optional C encoder/decoder, several times faster than the json module
+except ImportError:
+    orjson = None
 
 ENC = "utf-8"   # encoding for JSON text
 DELIM = b"\n"    # delimiter for JSON text
+MAX_FRAME = 16 * 1024 * 1024   # longest line a client receive buffer grows to
+IOV_BATCH = 512   # buffers passed to one sendmsg() call (stays below the usual IOV_MAX of 1024)
+RECV_SIZE = 64 * 1024   # bytes recv_json asks for per recv() call
+# Binary frames (file data) travel between the JSON lines: BIN_MAGIC, the lengths of a JSON
+# header and of the raw data, then both. JSON lines always start with "{", never with BIN_MAGIC
+BIN_MAGIC = 0x01
+BIN_HEADER = struct.Struct("!BII")   # magic, header length, data length
+
+_ts_cache = (-1, "", b"")   # (unix second, ISO timestamp, same as bytes) reused within one second
 
 _buffers: dict[int, bytearray] = {}   # buffers(key: socket ID, value: bytearray) to store residual data
 # message per call even when multiple messages arrive in one recv().
 
+def _iso_entry() -> tuple:
+    ''' The (second, str, bytes) timestamp entry for the current second, rebuilt once per second '''
+    global _ts_cache
+    sec = int(time.time())
+    cached = _ts_cache
+    if cached[0] != sec:
+        ts = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(sec))
+        cached = _ts_cache = (sec, ts, ts.encode())   # one tuple: readers see a consistent entry
+    return cached
+
+def iso_now() -> str:
+    ''' The function returns the current UTC time as an ISO 8601 string with seconds, e.g. 2024-01-01T12:00:00Z '''
+    return _iso_entry()[1]
+
+def iso_now_bytes() -> bytes:
+    ''' Same as iso_now, already encoded, for frames that are built as bytes '''
+    return _iso_entry()[2]
+
+def encode_json_body(obj: dict) -> bytes:
+    '''
+    The function encodes an object as JSON text in UTF-8, without the \n delimiter.
+    Input:
+        - obj: dict - the object to be sent
+    Output: bytes of the message body
+    '''
+    if orjson is not None:
+        # orjson emits compact UTF-8 bytes and escapes control characters, so it never
+        # produces a raw \n inside the message
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode(ENC)
+
+def encode_json(obj: dict) -> bytes:
+    '''
+    The function encodes an object as one framed message: JSON text followed by \n.
+    Input:
+        - obj: dict - the object to be sent
+    Output: bytes ready to be written to the socket
+    '''
+    return encode_json_body(obj) + DELIM
+
+def binary_frame_parts(header: bytes, data) -> list:
+    '''
+    The function frames raw data (e.g. an encrypted file chunk) with its JSON-encoded header as one
+    binary frame. The data is written as is: no Base64, no JSON escaping, no delimiter search.
+    Inputs:
+        - header: bytes - JSON-encoded envelope (without the \n delimiter)
+        - data: bytes-like object - the raw bytes
+    Output: list of buffers to write back to back (see send_parts)
+    '''
+    return [BIN_HEADER.pack(BIN_MAGIC, len(header), len(data)), header, data]
+
+def binary_frame_size(buf, start: int = 0) -> int:
+    '''
+    The function returns the total length of the binary frame that starts at buf[start], or 0 if
+    not even its fixed-size prefix has arrived yet. Raises ConnectionError above MAX_FRAME.
+    '''
+    if len(buf) - start < BIN_HEADER.size:
+        return 0
+    _, hlen, dlen = BIN_HEADER.unpack_from(buf, start)
+    size = BIN_HEADER.size + hlen + dlen
+    if size > MAX_FRAME:
+        raise ConnectionError("message too long")
+    return size
+
+def decode_binary(buf, start: int = 0, owned: bool = False) -> dict:
+    '''
+    The function decodes the complete binary frame at buf[start]: the JSON header, with the raw
+    data under the "data" key. The data is copied out of buf, which the caller reuses, unless
+    owned is True (buf is handed over): then it is a memoryview into buf, without a copy.
+    '''
+    _, hlen, dlen = BIN_HEADER.unpack_from(buf, start)
+    view = memoryview(buf)
+    h0 = start + BIN_HEADER.size
+    env = decode_json(view[h0:h0 + hlen])
+    data = view[h0 + hlen:h0 + hlen + dlen]
+    env["data"] = data if owned else bytes(data)
+    view.release()
+    return env
+
+def _skip_sent(views: list, sent: int) -> list:
+    ''' Drop the first sent bytes from a list of memoryviews (after a partial write) '''
+    i = 0
+    while i < len(views) and sent >= len(views[i]):
+        sent -= len(views[i])
+        i += 1
+    views = views[i:]
+    if sent:
+        views[0] = views[0][sent:]
+    return views
+
+def send_parts(sock: socket.socket, parts: list) -> None:
+    '''
+    The function sends several buffers back to back on a blocking socket, like
+    sock.sendall(b"".join(parts)) but with a scatter-gather sendmsg(): the kernel reads the
+    buffers in place, so no joined copy of the whole frame is built.
+    Inputs:
+        - sock: socket.socket - the socket to send the data through
+        - parts: list of bytes-like objects
+    Output: None
+    '''
+    if not hasattr(sock, "sendmsg"):   # e.g. Windows
+        sock.sendall(b"".join(parts))
+        return
+    views = [memoryview(p) for p in parts if len(p)]
+    while views:
+        sent = sock.sendmsg(views[:IOV_BATCH])
+        views = _skip_sent(views, sent)
+
+def send_parts_nowait(sock: socket.socket, parts: list) -> list:
+    '''
+    The non-blocking version of send_parts: sends what the kernel accepts right now.
+    Inputs:
+        - sock: socket.socket - a non-blocking socket
+        - parts: list of bytes-like objects
+    Output: list of memoryviews over the bytes that were not sent (empty if all were)
+    '''
+    views = [memoryview(p) for p in parts if len(p)]
+    try:
+        if hasattr(sock, "sendmsg"):
+            while views:
+                sent = sock.sendmsg(views[:IOV_BATCH])
+                views = _skip_sent(views, sent)
+        else:
+            data = b"".join(views)
+            sent = sock.send(data) if data else 0
+            views = [memoryview(data)[sent:]] if sent < len(data) else []
+    except (BlockingIOError, InterruptedError):
+        pass
+    return views
+
+def decode_json(line) -> dict:
+    '''
+    The function converts one received line (bytes without the \n) to a JSON object.
+    Input:
+        - line: bytes, bytearray or memoryview - the message text in UTF-8
+    Output:
+        - dict - the decoded JSON object
+    '''
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(bytes(line).decode(ENC))
+
+class FrameBuffer:
+    '''
+    Receive buffer of one connection. The socket is read straight into a preallocated
+    bytearray (recv_into), and every complete line in it is decoded in the same wake-up,
+    instead of one recv round trip per message. Binary frames (file data, see
+    binary_frame_parts) in between are taken by their length.
+    '''
+    __slots__ = ("_buf", "_view", "_tail", "_scanned")
+
+    def __init__(self, leftover: bytes = b"", size: int = RECV_SIZE):
+        ''' leftover: bytes already read from the socket; size: initial buffer size '''
+        self._buf = bytearray(max(size, len(leftover)))
+        self._view = memoryview(self._buf)
+        self._tail = 0   # bytes of _buf in use
+        self._scanned = 0   # bytes of _buf already searched for DELIM without finding one
+        if leftover:   # e.g. bytes recv_json already read past a handshake
+            self._buf[:len(leftover)] = leftover
+            self._tail = len(leftover)
+
+    def __len__(self) -> int:
+        ''' Bytes received but not taken as a complete message yet '''
+        return self._tail
+
+    def get_buffer(self) -> memoryview:
+        ''' Return the free part of the buffer to receive into '''
+        if self._tail == len(self._buf):
+            # A single message longer than the buffer: grow it
+            if len(self._buf) >= MAX_FRAME:
+                raise ConnectionError("message too long")
+            grown = bytearray(min(len(self._buf) * 2, MAX_FRAME))
+            grown[:self._tail] = self._view[:self._tail]
+            self._view.release()
+            self._buf, self._view = grown, memoryview(grown)
+        return self._view[self._tail:]
+
+    def frames(self, nbytes: int) -> List[Dict[str, Any]]:
+        ''' Account for nbytes just received and return every complete message decoded '''
+        self._tail += nbytes
+        buf, view, start = self._buf, self._view, 0
+        out = []
+        scanned = True   # the incomplete rest (if any) is a line already searched to the end
+        while start < self._tail:
+            if buf[start] == BIN_MAGIC:
+                size = binary_frame_size(view[:self._tail], start)
+                if not size or start + size > self._tail:
+                    scanned = False   # wait for the rest of the binary frame
+                    break
+                out.append(decode_binary(view, start))
+                start += size
+                continue
+            nl = buf.find(DELIM, max(start, self._scanned), self._tail)
+            if nl == -1:
+                self._scanned = self._tail
+                break
+            out.append(decode_json(view[start:nl]))
+            start = nl + 1
+        if start:
+            # Move the incomplete tail to the front (same-size slice assignment, no realloc)
+            rest = self._tail - start
+            buf[:rest] = view[start:self._tail]
+            self._tail = rest
+            self._scanned = rest if scanned else 0
+        return out
+
 def send_json(sock: socket.socket, obj: dict) -> None:
     '''
     The function sends an object that can be converted to JSON over a socket. 
@@ -16,13 +239,14 @@ def send_json(sock: socket.socket, obj: dict) -> None:
         - obj: dict - the object to be sent
     Output: None
     '''
-    data = (json.dumps(obj, ensure_ascii=False) + "\n").encode(ENC) # encode the object to bytes
-    sock.sendall(data)   # send all data(bytes) through the socket
+    body = encode_json_body(obj) # encode the object to bytes
+    send_parts(sock, [body, DELIM])   # send body and delimiter in one call, without concatenating
 
 def recv_json(sock: socket.socket) -> dict:
     '''
     The function receives a JSON object from a socket. It reads data until it encounters a newline character \n,
     which indicates the end of the JSON message. Then it decodes the bytes to text and converts it to a JSON object.
+    A binary frame (see binary_frame_parts) is read by its length instead, and returned by decode_binary.
     Input:
         - sock: socket.socket - the socket to receive data from
     Output:
@@ -30,19 +254,57 @@ def recv_json(sock: socket.socket) -> dict:
     '''
     fd = sock.fileno()   # get unique identifier (int ID) for this socket
     buf = _buffers.setdefault(fd, bytearray())  # get the existing buffer or create  new buffer for this socket
+    start = 0   # bytes before this are known to contain no delimiter
 
     while True:
-        # Check if we have a complete line in the buffer
-        nl = buf.find(DELIM)
-        if nl != -1:  # If new line found, that means one full JSON message has arrived.
-            line_bytes = buf[:nl]  # extract that line bytes
-            del buf[:nl+1]         # remove that line and delimiter from the buffer
-            line = line_bytes.decode(ENC)   # decode that bytes to text
-            return json.loads(line)         
+        want = RECV_SIZE
+        if buf and buf[0] == BIN_MAGIC:   # a binary frame: complete once all its bytes are here
+            size = binary_frame_size(buf)
+            if size and len(buf) == size:
+                # The buffer holds exactly this frame (the usual case for a file chunk): hand it
+                # over as the frame's data instead of copying the data out, and start a new one
+                _buffers[fd] = bytearray()
+                return decode_binary(buf, owned=True)
+            if size and len(buf) > size:
+                env = decode_binary(buf)
+                del buf[:size]
+                return env
+            if size:
+                want = min(RECV_SIZE, size - len(buf))   # read up to its end, not into the next frame
+        else:
+            # Check if we have a complete line in the buffer; only the newly received bytes are
+            # searched, so a long frame arriving in many pieces is scanned once, not once per piece
+            nl = buf.find(DELIM, start)
+            if nl != -1:  # If new line found, that means one full JSON message has arrived.
+                line_bytes = buf[:nl]  # extract that line bytes
+                del buf[:nl+1]         # remove that line and delimiter from the buffer
+                return decode_json(line_bytes)   # decode that bytes to a JSON object
 
         # Otherwise, read more from the socket
-        chunk = sock.recv(4096)   # read more bytes from the socket
+        start = len(buf)
+        chunk = sock.recv(want)   # read more bytes from the socket
         if not chunk:
             # Socket closed
             raise ConnectionError("socket closed")
         buf.extend(chunk)  # append the newly received bytes to the buffer
+
+def take_buffered(sock: socket.socket) -> bytes:
+    '''
+    The function removes and returns the bytes recv_json has read from this socket but not
+    consumed yet, so the FrameBuffer of the selectors loop can start with them.
+    Input:
+        - sock: socket.socket - the socket whose residual data is wanted
+    Output:
+        - bytes - the residual data (possibly empty)
+    '''
+    return bytes(_buffers.pop(sock.fileno(), b""))
+
+def release_buffered(sock: socket.socket) -> None:
+    '''
+    The function drops the buffer recv_json keeps for this socket. Call it before closing the
+    socket: the buffer is keyed by file descriptor, and the OS hands the same number to the
+    next socket, which would otherwise start with this connection's leftover bytes.
+    Input:
+        - sock: socket.socket - the socket that is about to be closed
+    '''
+    _buffers.pop(sock.fileno(), None)
@@ -1,20 +1,133 @@
-import socket, threading, traceback, datetime
+import selectors, socket, time, traceback
 from typing import Optional, Dict, Any
-from common.protocol import send_json, recv_json
-from common.crypto import rsa_generate, rsa_public_pem, rsa_unwrap_key, encrypt_body, decrypt_body
+from common.protocol import FrameBuffer, iso_now, send_parts_nowait, binary_frame_parts, encode_json_body, DELIM
+from common.crypto import aes_cipher, rsa_generate, rsa_public_pem, rsa_unwrap_key, encrypt_plain, decrypt_plain, encrypt_bin, decrypt_bin
 from server.state import ServerState, Client
 
 HOST = "0.0.0.0"
 PORT = 5050
 ENC = "utf-8"
+OUT_PAUSE = 4 * 1024 * 1024   # bytes queued for one client beyond which the client sending to it is not read from
+OUT_HIGH_WATER = 64 * 1024 * 1024   # bytes queued for one client beyond which that client is dropped
+SEND_TIMEOUT = 10.0   # seconds a client's queued bytes may stay unsent before that client is dropped
+
+class Connection:
+    ''' One client connection as the server loop sees it: its session, what was received and what is still to be sent '''
+    __slots__ = ("sock", "session", "rx", "out", "events", "paused", "waiters", "since", "dead")
+
+    def __init__(self, sock: socket.socket, session):
+        self.sock = sock
+        self.session = session   # the handle_client generator
+        self.rx = FrameBuffer()
+        self.out = bytearray()   # bytes the socket did not take yet, written on EVENT_WRITE
+        self.events = 0   # what the selector watches conn for (0: not registered)
+        self.paused = False   # not read from while a client it sent to is backed up
+        self.waiters = set()   # the connections paused on this one's queue
+        self.since = 0.0   # when out last made progress
+        self.dead = False   # dropped, ended by the loop before the next select
+
+_sel: Optional[selectors.BaseSelector] = None
+_conns: Dict[socket.socket, Connection] = {}   # by socket, as sends are addressed by socket
+_backlogged: set = set()   # connections with bytes queued (checked against SEND_TIMEOUT)
+_doomed: list = []   # dropped connections, to be ended by the loop
+_current: Optional[Connection] = None   # the connection whose frames are being routed
+_corked: Optional[set] = None   # while several frames of one read are routed: the sockets held corked
 
 state = ServerState()
 RSA_PRIV = rsa_generate()   # server's RSA private key
 RSA_PUB_PEM = rsa_public_pem(RSA_PRIV)   # server's RSA public key in PEM format
 
-def iso_now():
-    '''Return current UTC time in ISO format'''
-    return datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z"
+def _cork(sock: socket.socket, on: bool):
+    '''
+    Hold back (on) or push out (off) a socket's partial packets, so the frames written in between
+    leave as full-sized segments. TCP_CORK on Linux; elsewhere Nagle is re-enabled meanwhile.
+    '''
+    try:
+        if hasattr(socket, "TCP_CORK"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1 if on else 0)
+        else:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 0 if on else 1)
+    except OSError:
+        pass   # purely an optimization (or the socket is gone)
+
+def _watch(conn: Connection):
+    ''' Have the selector watch conn for reads unless it is paused, and for writes while it has bytes queued '''
+    events = (0 if conn.paused else selectors.EVENT_READ) | (selectors.EVENT_WRITE if conn.out else 0)
+    if events == conn.events:
+        return
+    if not conn.events:
+        _sel.register(conn.sock, events, conn)
+    elif not events:
+        _sel.unregister(conn.sock)
+    else:
+        _sel.modify(conn.sock, events, conn)
+    conn.events = events
+
+def _drop(conn: Connection):
+    ''' Mark conn to be ended by the loop (its session may be the one running right now) '''
+    if not conn.dead:
+        conn.dead = True
+        _doomed.append(conn)
+
+def _resume(conn: Connection):
+    ''' Read again from the connections that were paused on conn's queue '''
+    for w in conn.waiters:
+        w.paused = False
+        if not w.dead:
+            _watch(w)
+    conn.waiters.clear()
+
+def send_frame(sock: socket.socket, parts: list):
+    '''
+    The function writes one frame (a list of buffers) to a client without blocking the loop that
+    serves all clients: what the socket does not take now is queued and written on EVENT_WRITE.
+    While more than OUT_PAUSE is queued, the client whose frames are being routed there is not
+    read from; a client with more than OUT_HIGH_WATER queued, or whose queue has not moved for
+    SEND_TIMEOUT, is dropped. Sending to a dropped client raises ConnectionError.
+    '''
+    conn = _conns.get(sock)
+    if conn is None or conn.dead:
+        raise ConnectionError("client is gone")
+    if _corked is not None and sock not in _corked:
+        _cork(sock, True)
+        _corked.add(sock)
+    if not conn.out:
+        try:
+            parts = send_parts_nowait(sock, parts)
+        except OSError:
+            _drop(conn)
+            raise
+        if not parts:
+            return
+        conn.since = time.monotonic()
+        _backlogged.add(conn)
+    for p in parts:
+        conn.out += p
+    if len(conn.out) > OUT_HIGH_WATER:
+        _drop(conn)
+        raise ConnectionError("client is not reading")
+    _watch(conn)
+    src = _current
+    if len(conn.out) > OUT_PAUSE and src is not None and src is not conn and not src.paused:
+        src.paused = True   # TCP pushes back on the sender until conn catches up
+        conn.waiters.add(src)
+        _watch(src)
+
+def send_env(sock: socket.socket, env: Dict[str, Any]):
+    ''' The function sends one JSON envelope to a client (see send_frame) '''
+    send_frame(sock, [encode_json_body(env), DELIM])
+
+def broadcast_json(env: Dict[str, Any]):
+    '''
+    The function sends the same envelope to every client. It is encoded once and the same
+    bytes are written to each socket; a client that is gone does not stop the others.
+    '''
+    parts = [encode_json_body(env), DELIM]
+    for s in state.broadcast():
+        try:
+            send_frame(s, parts)
+        except OSError:
+            continue
 
 def send_system(msg: str, to_sock: socket.socket = None):
     '''
@@ -25,21 +138,21 @@ def send_system(msg: str, to_sock: socket.socket = None):
     '''
     env = {"type":"system","sender":None,"to":"*","ts":iso_now(),"payload":{"text":msg}}
     if to_sock: # specific socket(send message to specific user)
-        send_json(to_sock, env)
+        send_env(to_sock, env)
     else:  # broadcast to all
-        for s in state.broadcast():
-            send_json(s, env)
+        broadcast_json(env)
 
 def push_userlist():
     '''The function pushes the updated user list( include username + corresponding avatar_id) to all clients'''
     users = state.users()
     print(f"[SERVER DEBUG] Pushing userlist: {users}")  # Debug
     env = {"type":"userlist","sender":None,"to":"*","ts":iso_now(),"payload":{"users": users}}
-    for s in state.broadcast():
-        send_json(s, env)
+    broadcast_json(env)
 
 def handle_client(conn: socket.socket, addr):
-    ''' This function runs in its own thread for each client connection.
+    ''' This function is the conversation with one client connection, as a generator: the server
+        loop (see main) sends it every envelope received on conn, where it waits at "env = yield",
+        and closes it when the connection ends; the loop closes conn afterwards.
         Inputs:
         - conn: the socket connection between this client and server
         - addr: address of the connected client ( client's IP and port )
@@ -48,10 +161,10 @@ def handle_client(conn: socket.socket, addr):
     client_added = False  # Track if we successfully added this client
     try:
         # Check for authentication message
-        env = recv_json(conn)
+        env = yield
         if env.get("type") != "auth":  # Check if the first message is auth
-            send_json(conn, {"type":"error","sender":None,"to":None,"ts":iso_now(),"payload":{"code":"EXPECT_AUTH"}})
-            conn.close(); return # if not, close the connection
+            send_env(conn, {"type":"error","sender":None,"to":None,"ts":iso_now(),"payload":{"code":"EXPECT_AUTH"}})
+            return # if not, end the session (the loop closes the connection)
 
         username = env["payload"]["username"]
         avatar_id = env["payload"].get("avatar_id", 0)  # Get avatar_id, default 0
@@ -60,43 +173,43 @@ def handle_client(conn: socket.socket, addr):
         if not state.add_client(Client(username=username, sock=conn, avatar_id=avatar_id)):
             # If username is already taken → reject with "DUPLICATE_USERNAME" and close
             print(f"[SERVER] Username '{username}' already exists, rejecting new connection")
-            send_json(conn, {"type":"error","sender":None,"to":None,"ts":iso_now(),"payload":{"code":"DUPLICATE_USERNAME"}})
-            conn.close()
+            send_env(conn, {"type":"error","sender":None,"to":None,"ts":iso_now(),"payload":{"code":"DUPLICATE_USERNAME"}})
             return
         
         # Client was successfully added
         client_added = True
 
         # Server send its RSA public key to this client
-        send_json(conn, {"type":"key","sender":None,"to":username,"ts":iso_now(),"payload":{"server_pub_pem": RSA_PUB_PEM}})
+        send_env(conn, {"type":"key","sender":None,"to":username,"ts":iso_now(),"payload":{"server_pub_pem": RSA_PUB_PEM}})
 
         # Receive client's wrapped AES key
-        env = recv_json(conn)
+        env = yield
         # Validate key message
         if env.get("type") != "key" or "wrapped" not in env.get("payload", {}):  # if not key message or missing "wrapped" field
-            send_json(conn, {"type":"error","sender":None,"to":username,"ts":iso_now(),"payload":{"code":"EXPECT_AES_KEY"}})
-            state.remove(username); conn.close(); return # remove client and close connection if invalid
+            send_env(conn, {"type":"error","sender":None,"to":username,"ts":iso_now(),"payload":{"code":"EXPECT_AES_KEY"}})
+            state.remove(username); return # remove client and end the session if invalid
         
         # Unwrap AES key and store in client state
         aes = rsa_unwrap_key(RSA_PRIV, env["payload"]["wrapped"])
         c = state.get(username)   # retrieve client object
         if c is not None:
             c.aes_key = aes
+            c.aes_ctx = aes_cipher(aes)   # key schedule done once, not per message
 
         send_system(f"{username} joined the chatroom.")
         push_userlist()  # push updated user list to all clients
 
         # After authentication and key exchange are finished,the server enters an infinite loop to handle all future messages from that client.
         while True:
-            env = recv_json(conn)   # Receive messages from the client
+            env = yield   # Receive messages from the client
             etype = env.get("type")
-            if etype in ("pub","priv","file_offer","file_chunk","file_ack"):
+            if etype in ("pub","priv","file_offer","file_chunk","file_ack","file_chunk_bin"):
                 route(env)
             elif etype == "system" and env["payload"].get("event") == "leave":
                 break
             else:
                 # ignore/notify
-                send_json(conn, {"type":"error","sender":None,"to":username,"ts":iso_now(),"payload":{"code":"UNKNOWN_TYPE"}})
+                send_env(conn, {"type":"error","sender":None,"to":username,"ts":iso_now(),"payload":{"code":"UNKNOWN_TYPE"}})
 
     except Exception:
         # print for server operator
@@ -108,21 +221,22 @@ def handle_client(conn: socket.socket, addr):
             state.remove(username)
             send_system(f"{username} left the chatroom.")
             push_userlist()
-        try:
-            conn.close()
-        except Exception:
-            pass
 
 def route(env: Dict[str, Any]):
     to = env.get("to")
     sender = env.get("sender")
+    ts = env.get("ts")   # forwarded envelopes are built as literals from these fields
     cs = state.get(sender)   # get sender's client state
-    if not cs or not cs.aes_key:
+    if not cs or not cs.aes_ctx:
+        return
+    if env["type"] == "file_chunk_bin":
+        route_raw(env, cs)
         return
 
-    # Decrypt body with sender's AES session key
+    # Decrypt body with sender's AES session key. The body is only re-encrypted, never read
+    # here, so it stays JSON-encoded bytes: serialized once by the sender, not per recipient
     try:
-        body = decrypt_body(cs.aes_key, env["payload"]) # server decrypt body text from sender 
+        body = decrypt_plain(cs.aes_ctx, env["payload"]) # server decrypt body text from sender 
     except Exception:
         # If decryption fails, drop silently
         return
@@ -131,32 +245,30 @@ def route(env: Dict[str, Any]):
         # Re-encrypt for each recipient using their own AES key
         for rcpt in state.all_clients():
             try:
-                env2 = dict(env)
-                env2["to"] = "*"
-                env2["payload"] = encrypt_body(rcpt.aes_key, body)   # encrypt body text for each recipient
-                send_json(rcpt.sock, env2)
+                env2 = {"type": "pub", "sender": sender, "to": "*", "ts": ts,
+                        "payload": encrypt_plain(rcpt.aes_ctx, body)}   # encrypt body text for each recipient
+                send_env(rcpt.sock, env2)
             except Exception:
                 continue
     elif env["type"] == "file_offer" and to == "*":
         # broadcast file offer to everyone except the sender
         for rcpt in state.all_clients():
-            if rcpt.username == sender or not rcpt.aes_key:
+            if rcpt.username == sender or not rcpt.aes_ctx:
                 continue
             try:
-                env2 = dict(env)
-                env2["to"] = rcpt.username
-                env2["payload"] = encrypt_body(rcpt.aes_key, body)
-                send_json(rcpt.sock, env2)
+                env2 = {"type": "file_offer", "sender": sender, "to": rcpt.username, "ts": ts,
+                        "payload": encrypt_plain(rcpt.aes_ctx, body)}
+                send_env(rcpt.sock, env2)
             except Exception:
                 continue
     elif env["type"] in ("priv","file_offer","file_chunk","file_ack"):
         # if private message or file transfer, send only to the specified recipient
         c = state.get(to)
-        if c and c.aes_key:
+        if c and c.aes_ctx:
             try:
-                env2 = dict(env)
-                env2["payload"] = encrypt_body(c.aes_key, body)
-                send_json(c.sock, env2)
+                env2 = {"type": env["type"], "sender": sender, "to": to, "ts": ts,
+                        "payload": encrypt_plain(c.aes_ctx, body)}
+                send_env(c.sock, env2)
             except Exception:
                 pass
         else:
@@ -164,15 +276,140 @@ def route(env: Dict[str, Any]):
             if cs:
                 err = {"type":"error","sender":None,"to":sender,"ts":iso_now(),
                        "payload":{"code":"USER_NOT_FOUND","user":to}}
-                send_json(cs.sock, err)
+                send_env(cs.sock, err)
+
+def route_raw(env: Dict[str, Any], cs: Client):
+    '''
+    Forward a binary file chunk (a binary frame, see common.protocol) to its recipient. The body is
+    not JSON: it is decrypted and re-encrypted as bytes and sent as a binary frame again, so the
+    file data is never parsed, escaped or Base64-coded here.
+    '''
+    to = env.get("to")
+    try:
+        body = decrypt_bin(cs.aes_ctx, env["payload"], env.pop("data"))
+    except Exception:
+        return
+    c = state.get(to)
+    if c and c.aes_ctx:
+        try:
+            payload, data = encrypt_bin(c.aes_ctx, body)
+            env2 = {"type": "file_chunk_bin", "sender": cs.username, "to": to, "ts": env.get("ts"), "payload": payload}
+            send_frame(c.sock, binary_frame_parts(encode_json_body(env2), data))
+        except Exception:
+            pass
+    else:
+        err = {"type":"error","sender":None,"to":cs.username,"ts":iso_now(),
+               "payload":{"code":"USER_NOT_FOUND","user":to}}
+        send_env(cs.sock, err)
+
+def _end_session(conn: Connection):
+    ''' Stop watching conn and finish its session (runs its cleanup), then close the socket '''
+    _conns.pop(conn.sock, None)
+    _backlogged.discard(conn)
+    if conn.events:
+        _sel.unregister(conn.sock)
+        conn.events = 0
+    _resume(conn)
+    conn.session.close()
+    try:
+        if conn.out:
+            conn.sock.send(conn.out)   # last words (e.g. an error), as far as they fit
+    except OSError:
+        pass
+    try:
+        conn.sock.close()
+    except OSError:
+        pass
+
+def _on_writable(conn: Connection):
+    ''' Write as much of conn's queued bytes as the socket takes now '''
+    try:
+        sent = conn.sock.send(conn.out)
+    except (BlockingIOError, InterruptedError):
+        return
+    except OSError:
+        _drop(conn)
+        return
+    del conn.out[:sent]
+    conn.since = time.monotonic()
+    if len(conn.out) <= OUT_PAUSE // 2:
+        _resume(conn)
+    if not conn.out:
+        _backlogged.discard(conn)
+    _watch(conn)
+
+def _on_readable(conn: Connection):
+    ''' Receive what is available on conn and feed every complete envelope to its session '''
+    try:
+        nbytes = conn.sock.recv_into(conn.rx.get_buffer())
+    except (BlockingIOError, InterruptedError):
+        return
+    except OSError:
+        nbytes = 0   # reset
+    if not nbytes:
+        _drop(conn)
+        return
+    global _corked, _current
+    _current = conn
+    try:
+        frames = conn.rx.frames(nbytes)
+        if len(frames) > 1:
+            # Several messages in one read (e.g. a run of file chunks): cork every socket they are
+            # forwarded to until all are routed, instead of one push per frame
+            _corked = set()
+        for env in frames:
+            conn.session.send(env)
+    except StopIteration:   # the client left, or its session failed (already reported)
+        _drop(conn)
+    except Exception:   # e.g. a malformed frame
+        traceback.print_exc()
+        _drop(conn)
+    finally:
+        _current = None
+        if _corked is not None:
+            for s in _corked:
+                _cork(s, False)
+            _corked = None
+
+def _expire():
+    ''' Drop the clients whose queued bytes have not moved for SEND_TIMEOUT '''
+    now = time.monotonic()
+    for conn in list(_backlogged):
+        if now - conn.since > SEND_TIMEOUT:
+            print(f"[SERVER] Client not reading for {SEND_TIMEOUT:g}s, dropping it")
+            _backlogged.discard(conn)
+            _drop(conn)
 
 def main():
+    '''
+    Serve all clients from one thread: a selectors loop waits for new connections, for data on
+    the connected ones and for room to write what they were sent, so a client costs a socket, its
+    buffers and a suspended handle_client generator instead of a thread with its own stack.
+    '''
+    global _sel
     print(f"Server listening on {HOST}:{PORT}")
+    _sel = selectors.DefaultSelector()
     with socket.create_server((HOST, PORT)) as srv: # create server socket 
+        _sel.register(srv, selectors.EVENT_READ)
         while True:
-            conn, addr = srv.accept()   # accept new client connection
-            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)   # if receive data, send or read it immediately
-            threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()  # create a 
+            for key, mask in _sel.select(1.0 if _backlogged else None):
+                if key.fileobj is srv:
+                    sock, addr = srv.accept()   # accept new client connection
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)   # if receive data, send or read it immediately
+                    sock.setblocking(False)   # sends queue what does not fit (see send_frame)
+                    conn = Connection(sock, handle_client(sock, addr))
+                    next(conn.session)   # run it up to the first "env = yield"
+                    _conns[sock] = conn
+                    _watch(conn)
+                    continue
+                conn = key.data
+                if mask & selectors.EVENT_WRITE and not conn.dead:
+                    _on_writable(conn)
+                if mask & selectors.EVENT_READ and not (conn.dead or conn.paused):
+                    _on_readable(conn)
+            _expire()
+            while _doomed:   # between events, so no dropped session is running
+                _end_session(_doomed.pop())
 
 if __name__ == "__main__":
     main()
@@ -1,50 +1,65 @@
 from dataclasses import dataclass
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 import socket
 from threading import Lock
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 @dataclass   # decorator to automatically generate init, repr, etc.
 class Client:   # container class for storing info about each client
     username: str     # unique username
     sock: socket.socket  # socket connected to the client
     aes_key: Optional[bytes] = None    # Optional AES key for encrypting/decrypting messages
+    aes_ctx: Optional[AESGCM] = None   # AESGCM object for aes_key, built once per session (see aes_cipher)
     avatar_id: int = 0   # User's avatar ID (0-1, default 0)
 
 class ServerState:
-    # This class manages all connected clients on the server
+    # This class manages all connected clients on the server.
+    # Joins and leaves are rare next to lookups (every routed message), so the client set is
+    # copy-on-write: writers build new containers under the lock and publish them by replacing
+    # the attributes; readers just load an attribute, without taking the lock.
     def __init__(self):
-        self.lock = Lock()  # creates a lock object to guard shared data
-        self.clients: Dict[str, Client] = {}   # dictionary mapping usernames to Client objects
+        self.lock = Lock()  # serializes writers (add_client/remove)
+        self.clients: Dict[str, Client] = {}   # dictionary mapping usernames to Client objects (never mutated in place)
+        self._snapshot: Tuple[Client, ...] = ()   # the same clients, for iteration
+        self._users: list = []   # users() result for this snapshot
+
+    def _publish(self, clients: Dict[str, Client]):
+        ''' Install a new client dict and everything derived from it (caller holds the lock) '''
+        self._snapshot = tuple(clients.values())
+        self._users = [{"username": u, "avatar_id": c.avatar_id} for u, c in clients.items()]
+        self.clients = clients
 
     def add_client(self, c: Client) -> bool:
         ''' This function adds a new client to the server state'''
         with self.lock:   # acquire the lock to ensure thread-safe access
             if c.username in self.clients:
                 return False
-            self.clients[c.username] = c
+            clients = dict(self.clients)
+            clients[c.username] = c
+            self._publish(clients)
             return True
 
     def remove(self, username: str):
         ''' This function removes a client from the server state by username'''
         with self.lock:
-            self.clients.pop(username, None)
+            if username in self.clients:
+                clients = dict(self.clients)
+                del clients[username]
+                self._publish(clients)
 
     def get(self, username: str) -> Optional[Client]:
         ''' This function retrieves a client from the server state by username'''
-        with self.lock:
-            return self.clients.get(username)
+        return self.clients.get(username)
 
     def users(self):
-        ''' This function retrieves a list of all usernames with their avatar_ids in the server state'''
-        with self.lock:
-            return [{"username": u, "avatar_id": c.avatar_id} for u, c in self.clients.items()]
+        ''' This function retrieves a list of all usernames with their avatar_ids in the server state.
+            The list is built once per change of the client set and shared: callers must not modify it '''
+        return self._users
 
     def broadcast(self, except_user: Optional[str] = None):
         ''' This function retrieves a list of all client sockets except for the specified username'''
-        with self.lock:
-            return [c.sock for u, c in self.clients.items() if u != except_user]
+        return [c.sock for c in self._snapshot if c.username != except_user]
 
     def all_clients(self):
-        ''' This function retrieves a list of all clients in the server state'''
-        with self.lock:
-            return list(self.clients.values())
+        ''' This function retrieves all clients in the server state (an immutable snapshot) '''
+        return self._snapshot